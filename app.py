@@ -1,118 +1,1270 @@
 import streamlit as st
 import sqlite3
-import pandas as pd
+import bisect
 import csv
+import functools
+import gc
+import hashlib
+import heapq
+import importlib
+import io
+import itertools
+import json
+import logging
+import mmap
 import os
+import queue
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from urllib.parse import quote
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# Function to load data from CSV files
-def load_csv_data():
-    """Load data from CSV files and return as dictionaries"""
-    data_dir = 'data'
-    
-    # Load countries
-    countries = {}
-    country_file = os.path.join(data_dir, 'country.csv')
-    if os.path.exists(country_file):
-        try:
-            with open(country_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        countries[int(row['id'])] = {
-                            'name': row['name'],
-                            'total_hotels': int(row.get('total_hotels', 0))
-                        }
-                    except (ValueError, KeyError) as e:
-                        continue  # Skip invalid rows
-        except Exception as e:
-            print(f"Error reading country file: {e}")
+# Number of CSV rows parsed and written per batch while loading the database
+LOAD_BATCH_SIZE = 5000
+
+# Parsed CSV rows. __slots__ keeps a record to a few pointers instead of a dict.
+class Place:
+    """A country, city or area; parent_id is the country of a city and the city of an area"""
+    __slots__ = ('id', 'name', 'parent_id', 'total_hotels')
     
-    # Load cities
-    cities = {}
-    city_file = os.path.join(data_dir, 'city.csv')
-    if os.path.exists(city_file):
-        try:
-            with open(city_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        cities[int(row['id'])] = {
-                            'name': row['name'],
-                            'country_id': int(row['country_id']),
-                            'total_hotels': int(row.get('total_hotels', 0))
-                        }
-                    except (ValueError, KeyError) as e:
-                        continue  # Skip invalid rows
-        except Exception as e:
-            print(f"Error reading city file: {e}")
+    def __init__(self, id, name, parent_id=None, total_hotels=0):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.total_hotels = total_hotels
+
+class Destination:
+    __slots__ = ('id', 'country_id', 'country_name', 'city_id', 'city_name', 'area_id', 'area_name', 'is_publish')
     
-    # Load areas
-    areas = {}
-    area_file = os.path.join(data_dir, 'area.csv')
-    if os.path.exists(area_file):
-        try:
-            with open(area_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        areas[int(row['id'])] = {
-                            'name': row['name'],
-                            'city_id': int(row['city_id']),
-                            'total_hotels': int(row.get('total_hotels', 0))
-                        }
-                    except (ValueError, KeyError) as e:
-                        continue  # Skip invalid rows
-        except Exception as e:
-            print(f"Error reading area file: {e}")
+    def __init__(self, id, country_id, country_name, city_id, city_name, area_id, area_name, is_publish):
+        self.id = id
+        self.country_id = country_id
+        self.country_name = country_name
+        self.city_id = city_id
+        self.city_name = city_name
+        self.area_id = area_id
+        self.area_name = area_name
+        self.is_publish = is_publish
+
+# Functions to parse a single CSV row, raising ValueError or KeyError for invalid rows
+def parse_country_row(row):
+    return Place(int(row['id']), row['name'], None, int(row.get('total_hotels', 0)))
+
+def parse_city_row(row):
+    return Place(int(row['id']), row['name'], int(row['country_id']), int(row.get('total_hotels', 0)))
+
+def parse_area_row(row):
+    return Place(int(row['id']), row['name'], int(row['city_id']), int(row.get('total_hotels', 0)))
+
+def parse_destination_row(row):
+    # Handle empty string values that should be None
+    country_id = int(row['country_id']) if row['country_id'] and row['country_id'].strip() else None
+    city_id = int(row['city_id']) if row['city_id'] and row['city_id'].strip() else None
+    area_id = int(row['area_id']) if row['area_id'] and row['area_id'].strip() else None
+    
+    return Destination(
+        int(row['id']),
+        country_id,
+        row.get('country_name', '').strip(),
+        city_id,
+        row.get('city_name', '').strip(),
+        area_id,
+        row.get('area_name', '').strip(),
+        int(row.get('is_publish', 1))
+    )
+
+# Function to pause the cyclic garbage collector. Unlike dicts of strings and
+# numbers, __slots__ records are always tracked by it, and collections
+# triggered by allocating them would find nothing to free.
+@contextmanager
+def paused_gc():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# Function to read a CSV file in batches of parsed rows
+def read_csv_batches(file_name, parse_row, data_dir='data', batch_size=LOAD_BATCH_SIZE):
+    """Yield lists of at most batch_size parsed rows, skipping invalid rows"""
+    if data_dir is None:
+        return
+    file_path = os.path.join(data_dir, file_name)
+    if not os.path.exists(file_path):
+        return
+    
+    batch = []
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            while True:
+                with paused_gc():
+                    for row in reader:
+                        try:
+                            batch.append(parse_row(row))
+                        except (ValueError, KeyError) as e:
+                            continue  # Skip invalid rows
+                        if len(batch) >= batch_size:
+                            break
+                if len(batch) < batch_size:
+                    break  # End of file
+                yield batch
+                batch = []
+    except Exception as e:
+        print(f"Error reading {file_name}: {e}")
+    
+    if batch:
+        yield batch
+
+# Columnar tables of parsed rows: ids and numbers live in typed arrays (0 for
+# a missing id) and names in lists of interned strings, so rows repeating a
+# name share one string. Records are created only when a row is read.
+class PlaceTable:
+    """Places by id; a later row with the same id replaces an earlier one"""
+    def __init__(self, places=()):
+        self.ids = array('q')
+        self.names = []
+        self.parent_ids = array('q')
+        self.total_hotels = array('q')
+        self._sorted = True  # Ids are checked, sorted and indexed on the first lookup after an extend
+        self._offset = 0
+        self._index = array('q')
+        self.extend(places)
+    
+    def extend(self, places):
+        if isinstance(places, PlaceTable):
+            # Merge the columns of another table, e.g. one parsed by a worker process
+            self.ids.extend(places.ids)
+            self.names.extend(places.names)
+            self.parent_ids.extend(places.parent_ids)
+            self.total_hotels.extend(places.total_hotels)
+            self._sorted = False
+            return
+        places = list(places)
+        self.ids.extend([place.id for place in places])
+        self.names.extend([sys.intern(place.name) for place in places])
+        self.parent_ids.extend([place.parent_id or 0 for place in places])
+        self.total_hotels.extend([place.total_hotels for place in places])
+        self._sorted = False
+    
+    def _sort(self):
+        ids = self.ids
+        if not all(ids[i] < ids[i + 1] for i in range(len(ids) - 1)):
+            # Keep the last row of each id, in id order
+            positions = {}
+            for position, place_id in enumerate(ids):
+                positions[place_id] = position
+            order = [positions[place_id] for place_id in sorted(positions)]
+            del positions
+            self.ids = array('q', (ids[i] for i in order))
+            self.names = [self.names[i] for i in order]
+            self.parent_ids = array('q', (self.parent_ids[i] for i in order))
+            self.total_hotels = array('q', (self.total_hotels[i] for i in order))
+        
+        # Ids are usually dense, so positions can be looked up by id offset
+        self._offset = self.ids[0] if self.ids else 0
+        span = self.ids[-1] - self._offset + 1 if self.ids else 0
+        self._index = None
+        if span <= 2 * len(self.ids):
+            self._index = array('q', [-1]) * span
+            for position, place_id in enumerate(self.ids):
+                self._index[place_id - self._offset] = position
+        self._sorted = True
+    
+    def _position(self, place_id):
+        """Return the position of place_id, or None"""
+        if not self._sorted:
+            self._sort()
+        if self._index is not None:
+            offset = place_id - self._offset
+            if 0 <= offset < len(self._index) and self._index[offset] >= 0:
+                return self._index[offset]
+            return None
+        position = bisect.bisect_left(self.ids, place_id)
+        if position < len(self.ids) and self.ids[position] == place_id:
+            return position
+        return None
+    
+    def _place(self, position):
+        return Place(self.ids[position], self.names[position], self.parent_ids[position] or None, self.total_hotels[position])
+    
+    def get(self, place_id, default=None):
+        position = self._position(place_id)
+        return default if position is None else self._place(position)
+    
+    def name(self, place_id):
+        """Return the name of place_id without creating a record, or None"""
+        position = self._position(place_id)
+        return None if position is None else self.names[position]
+    
+    def rows(self, parent=True):
+        """Yield (id, name, parent_id, total_hotels) tuples, or (id, name, total_hotels) without parent"""
+        if not self._sorted:
+            self._sort()
+        if not parent:
+            return zip(self.ids, self.names, self.total_hotels)
+        return zip(self.ids, self.names, (parent_id or None for parent_id in self.parent_ids), self.total_hotels)
+    
+    def __contains__(self, place_id):
+        return self._position(place_id) is not None
     
-    # Load destinations
-    destinations = []
-    destination_file = os.path.join(data_dir, 'destination.csv')
-    if os.path.exists(destination_file):
+    def __len__(self):
+        if not self._sorted:
+            self._sort()
+        return len(self.ids)
+    
+    def __iter__(self):
+        if not self._sorted:
+            self._sort()
+        return (self._place(position) for position in range(len(self.ids)))
+
+class DestinationTable:
+    """Destinations in file order"""
+    def __init__(self, destinations=()):
+        self.ids = array('q')
+        self.country_ids = array('q')
+        self.city_ids = array('q')
+        self.area_ids = array('q')
+        self.is_publish = array('q')
+        self.country_names = []
+        self.city_names = []
+        self.area_names = []
+        self.extend(destinations)
+    
+    def extend(self, destinations):
+        if isinstance(destinations, DestinationTable):
+            for column in ('ids', 'country_ids', 'city_ids', 'area_ids', 'is_publish', 'country_names', 'city_names', 'area_names'):
+                getattr(self, column).extend(getattr(destinations, column))
+            return
+        destinations = list(destinations)
+        self.ids.extend([dest.id for dest in destinations])
+        self.country_ids.extend([dest.country_id or 0 for dest in destinations])
+        self.city_ids.extend([dest.city_id or 0 for dest in destinations])
+        self.area_ids.extend([dest.area_id or 0 for dest in destinations])
+        self.is_publish.extend([dest.is_publish for dest in destinations])
+        self.country_names.extend([sys.intern(dest.country_name) for dest in destinations])
+        self.city_names.extend([sys.intern(dest.city_name) for dest in destinations])
+        self.area_names.extend([sys.intern(dest.area_name) for dest in destinations])
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield Destination(
+                self.ids[i],
+                self.country_ids[i] or None, self.country_names[i],
+                self.city_ids[i] or None, self.city_names[i],
+                self.area_ids[i] or None, self.area_names[i],
+                self.is_publish[i]
+            )
+
+# Parallel CSV parsing settings. Large files are split into byte ranges that
+# start and end on row boundaries, and the ranges are parsed in worker processes.
+PARSE_WORKERS = min(8, os.cpu_count() or 1)
+PARALLEL_PARSE_MIN_BYTES = 16 * 1024 * 1024  # Smaller files are parsed in this process
+PARSE_CHUNK_BYTES = 4 * 1024 * 1024
+CHUNK_SCAN_BYTES = 64 * 1024
+
+# Function to split a CSV file into byte ranges that start and end on row boundaries
+def csv_chunk_offsets(file_path, chunk_bytes=None):
+    """Return (header_end, [(start, end), ...]) for the rows after the header line.
+
+    A newline ends a row only outside quoted fields, i.e. after an even number
+    of quote characters, since quotes inside quoted fields are doubled.
+    """
+    chunk_bytes = chunk_bytes or PARSE_CHUNK_BYTES
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header_end = len(f.readline())
+        boundaries = [header_end]
+        position = header_end
+        quotes = 0  # Quote characters between header_end and position
+        target = header_end + chunk_bytes
+        while target < size:
+            block = f.read(target - position)
+            quotes += block.count(b'"')
+            position += len(block)
+            
+            # Scan forward to the first newline outside quotes
+            boundary = None
+            while boundary is None:
+                block = f.read(CHUNK_SCAN_BYTES)
+                if not block:
+                    break
+                newline = block.find(b'\n')
+                while newline != -1:
+                    if (quotes + block.count(b'"', 0, newline)) % 2 == 0:
+                        boundary = position + newline + 1
+                        break
+                    newline = block.find(b'\n', newline + 1)
+                if boundary is None:
+                    quotes += block.count(b'"')
+                    position += len(block)
+            if boundary is None or boundary >= size:
+                break
+            quotes += block.count(b'"', 0, boundary - position)
+            position = boundary
+            f.seek(position)
+            boundaries.append(boundary)
+            target = boundary + chunk_bytes
+    boundaries.append(size)
+    return header_end, list(zip(boundaries, boundaries[1:]))
+
+# Function to parse one byte range of a CSV file in a worker process
+def parse_csv_chunk(file_path, start, end, fieldnames, parse_row, table_class):
+    """Return (table of the parsed rows, error message or None), with the rules of read_csv_batches"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    rows = []
+    error = None
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Keep the whole lines before the undecodable bytes
+        text = data[:e.start].decode('utf-8')
+        text = text[:text.rfind('\n') + 1]
+        error = str(e)
+    with paused_gc():
         try:
-            with open(destination_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        # Handle empty string values that should be None
-                        country_id = int(row['country_id']) if row['country_id'] and row['country_id'].strip() else None
-                        city_id = int(row['city_id']) if row['city_id'] and row['city_id'].strip() else None
-                        area_id = int(row['area_id']) if row['area_id'] and row['area_id'].strip() else None
-                        
-                        destinations.append({
-                            'id': int(row['id']),
-                            'country_id': country_id,
-                            'country_name': row.get('country_name', '').strip(),
-                            'city_id': city_id,
-                            'city_name': row.get('city_name', '').strip(),
-                            'area_id': area_id,
-                            'area_name': row.get('area_name', '').strip(),
-                            'is_publish': int(row.get('is_publish', 1))
-                        })
-                    except (ValueError, KeyError) as e:
-                        continue  # Skip invalid rows
+            # Universal newlines, as the text-mode file read_csv_batches opens
+            for row in csv.DictReader(io.StringIO(text, newline=None), fieldnames=fieldnames):
+                try:
+                    rows.append(parse_row(row))
+                except (ValueError, KeyError) as e:
+                    continue  # Skip invalid rows
         except Exception as e:
-            print(f"Error reading destination file: {e}")
+            error = str(e)
+    return table_class(rows), error
+
+# Function to parse a large CSV file in a process pool
+def read_csv_parallel(file_name, parse_row, table_class, data_dir='data', workers=None, min_bytes=None):
+    """Yield tables of parsed rows in file order, or return None if the file should be read with read_csv_batches.
+
+    Rows are validated as read_csv_batches validates them, and as there, an
+    unexpected error stops reading the file after the rows parsed before it.
+    Workers import this module, so the script run by `streamlit run`, which
+    is not importable under its module name, always parses in-process.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    min_bytes = PARALLEL_PARSE_MIN_BYTES if min_bytes is None else min_bytes
+    if data_dir is None or workers <= 1 or __name__ == '__main__':
+        return None
+    file_path = os.path.join(data_dir, file_name)
+    if not os.path.exists(file_path) or os.path.getsize(file_path) < min_bytes:
+        return None
+    return _read_csv_parallel(file_path, file_name, parse_row, table_class, workers)
+
+def _read_csv_parallel(file_path, file_name, parse_row, table_class, workers):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        fieldnames = csv.DictReader(f).fieldnames
+    if not fieldnames:
+        return
+    _, chunks = csv_chunk_offsets(file_path)
+    
+    # Imported here, as multiprocessing is only needed for large loads
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Keep a bounded window of chunks in flight, so parsed tables do not pile up
+    # while the caller writes earlier ones
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        chunks = iter(chunks)
+        for start, end in itertools.islice(chunks, 2 * workers):
+            pending.append(executor.submit(parse_csv_chunk, file_path, start, end, fieldnames, parse_row, table_class))
+        while pending:
+            table, error = pending.popleft().result()
+            for start, end in itertools.islice(chunks, 1):
+                pending.append(executor.submit(parse_csv_chunk, file_path, start, end, fieldnames, parse_row, table_class))
+            if len(table):
+                yield table
+            if error:
+                print(f"Error reading {file_name}: {error}")
+                for future in pending:
+                    future.cancel()
+                return
+
+# Function to create countries from the country names of destinations
+def countries_from_destinations(destinations):
+    country_names = set()
+    for dest in destinations:
+        if dest.country_name and dest.country_id:
+            country_names.add((dest.country_id, dest.country_name))
+    return PlaceTable(Place(country_id, country_name) for country_id, country_name in country_names)
+
+# Function to load data from CSV files
+def load_csv_data(data_dir='data'):
+    """Load data from CSV files and return them as PlaceTable and DestinationTable columns"""
+    countries = PlaceTable()
+    for batch in read_csv_batches('country.csv', parse_country_row, data_dir):
+        countries.extend(batch)
+    
+    cities = PlaceTable()
+    for batch in (read_csv_parallel('city.csv', parse_city_row, PlaceTable, data_dir)
+                  or read_csv_batches('city.csv', parse_city_row, data_dir)):
+        cities.extend(batch)
+    
+    areas = PlaceTable()
+    for batch in (read_csv_parallel('area.csv', parse_area_row, PlaceTable, data_dir)
+                  or read_csv_batches('area.csv', parse_area_row, data_dir)):
+        areas.extend(batch)
+    
+    destinations = DestinationTable()
+    for batch in (read_csv_parallel('destination.csv', parse_destination_row, DestinationTable, data_dir)
+                  or read_csv_batches('destination.csv', parse_destination_row, data_dir)):
+        destinations.extend(batch)
     
     # If no countries were loaded from CSV but we have destinations with country names,
     # create countries from destination data
     if not countries and destinations:
-        country_names = set()
-        for dest in destinations:
-            if dest['country_name'] and dest['country_id']:
-                country_names.add((dest['country_id'], dest['country_name']))
-        
-        for country_id, country_name in country_names:
-            countries[country_id] = {
-                'name': country_name,
-                'total_hotels': 0
-            }
+        countries = countries_from_destinations(destinations)
     
     return countries, cities, areas, destinations
 
+# Function to resolve destinations to rows of the destination table
+def build_destination_rows(destinations_data, countries_data, cities_data, areas_data):
+    """Return (id, name, country_id, city_id, area_id, type) rows for published destinations"""
+    destinations_to_insert = []
+    for dest in destinations_data:
+        if dest.is_publish == 1:  # Only published destinations
+            if dest.area_id:
+                # Area destination
+                area_name = areas_data.name(dest.area_id)
+                if area_name is not None:
+                    destinations_to_insert.append((
+                        dest.id,
+                        area_name,
+                        dest.country_id,
+                        dest.city_id,
+                        dest.area_id,
+                        'area'
+                    ))
+            elif dest.city_id:
+                # City destination
+                city_name = cities_data.name(dest.city_id)
+                if city_name is not None:
+                    destinations_to_insert.append((
+                        dest.id,
+                        city_name,
+                        dest.country_id,
+                        dest.city_id,
+                        None,
+                        'city'
+                    ))
+            elif dest.country_id:
+                # Country-only destination (treat as city)
+                country_name = countries_data.name(dest.country_id)
+                if country_name is not None:
+                    destinations_to_insert.append((
+                        dest.id,
+                        country_name,
+                        dest.country_id,
+                        None,
+                        None,
+                        'city'
+                    ))
+    return destinations_to_insert
+
+# Function to stream the CSV files into the database
+def ingest_csv_data(cursor, data_dir='data', batch_size=LOAD_BATCH_SIZE, table_prefix=''):
+    """Load the CSV files into the database with batched executemany calls.
+
+    Countries, cities and areas are kept in memory as PlaceTable columns to resolve destination names,
+    while destination.csv is streamed batch by batch, so memory does not grow with
+    its size. Files larger than PARALLEL_PARSE_MIN_BYTES are parsed in a process
+    pool. Falls back to sample data when no country data is found. Runs in the
+    caller's transaction and returns load statistics, including rows per second.
+    table_prefix selects other tables with the same columns, e.g. 'temp.staging_'.
+    """
+    start_time = time.perf_counter()
+    
+    countries_data = PlaceTable()
+    for batch in read_csv_batches('country.csv', parse_country_row, data_dir, batch_size):
+        countries_data.extend(batch)
+    
+    # If no countries were loaded from CSV, create them from destination country names
+    if not countries_data:
+        countries_data = countries_from_destinations(
+            dest
+            for batch in read_csv_batches('destination.csv', parse_destination_row, data_dir, batch_size)
+            for dest in batch
+        )
+    
+    sample_data = not countries_data
+    if sample_data:
+        # Fallback to sample data if CSV files are not available
+        countries_data = PlaceTable([
+            Place(1, 'France'),
+            Place(2, 'United Kingdom'),
+            Place(3, 'United States'),
+            Place(4, 'Japan')
+        ])
+        cities_data = PlaceTable([
+            Place(1, 'Paris', 1, 320),
+            Place(2, 'London', 2, 270),
+            Place(3, 'New York', 3, 420),
+            Place(4, 'Tokyo', 4, 380)
+        ])
+        areas_data = PlaceTable([
+            Place(1, 'Eiffel Tower', 1, 35),
+            Place(2, 'Buckingham Palace', 2, 15),
+            Place(3, 'Central Park', 3, 50),
+            Place(4, 'Shibuya Crossing', 4, 25)
+        ])
+    else:
+        cities_data = PlaceTable()
+        for batch in (read_csv_parallel('city.csv', parse_city_row, PlaceTable, data_dir)
+                      or read_csv_batches('city.csv', parse_city_row, data_dir, batch_size)):
+            cities_data.extend(batch)
+        
+        areas_data = PlaceTable()
+        for batch in (read_csv_parallel('area.csv', parse_area_row, PlaceTable, data_dir)
+                      or read_csv_batches('area.csv', parse_area_row, data_dir, batch_size)):
+            areas_data.extend(batch)
+    
+    # Insert countries, cities and areas
+    cursor.executemany(
+        f'INSERT OR IGNORE INTO {table_prefix}country (id, name, total_hotels) VALUES (?, ?, ?)',
+        countries_data.rows(parent=False)
+    )
+    cursor.executemany(
+        f'INSERT OR IGNORE INTO {table_prefix}city (id, name, country_id, total_hotels) VALUES (?, ?, ?, ?)',
+        cities_data.rows()
+    )
+    cursor.executemany(
+        f'INSERT OR IGNORE INTO {table_prefix}area (id, name, city_id, total_hotels) VALUES (?, ?, ?, ?)',
+        areas_data.rows()
+    )
+    
+    # Stream destinations from CSV, one executemany per batch
+    destination_count = 0
+    for batch in (read_csv_parallel('destination.csv', parse_destination_row, DestinationTable, data_dir)
+                  or read_csv_batches('destination.csv', parse_destination_row, data_dir, batch_size)):
+        destination_count += len(batch)
+        cursor.executemany(
+            f'INSERT OR IGNORE INTO {table_prefix}destination (id, name, country_id, city_id, area_id, type) VALUES (?, ?, ?, ?, ?, ?)',
+            build_destination_rows(batch, countries_data, cities_data, areas_data)
+        )
+    
+    if destination_count == 0:
+        # Create destinations from cities and areas if no destination CSV
+        city_destinations = (
+            (city.id, city.name, city.parent_id, city.id, None, 'city')
+            for city in cities_data
+        )
+        area_destinations = (
+            (
+                area.id + 10000,  # Offset to avoid ID conflicts
+                area.name,
+                cities_data.get(area.parent_id).parent_id,
+                area.parent_id,
+                area.id,
+                'area'
+            )
+            for area in areas_data
+            if area.parent_id in cities_data
+        )
+        for rows in (city_destinations, area_destinations):
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO {table_prefix}destination (id, name, country_id, city_id, area_id, type) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+    
+    elapsed = time.perf_counter() - start_time
+    row_count = len(countries_data) + len(cities_data) + len(areas_data) + destination_count
+    return {
+        'countries': len(countries_data),
+        'cities': len(cities_data),
+        'areas': len(areas_data),
+        'destinations': destination_count,
+        'sample_data': sample_data,
+        'seconds': elapsed,
+        'rows_per_second': row_count / elapsed if elapsed > 0 else 0
+    }
+
+# Function to create the indexes of the base tables
+def create_indexes(cursor):
+    # Create index on total_score for faster sorting in search results
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_destination_score_total_score 
+        ON destination_score(total_score DESC)
+    ''')
+    
+    # Create necessary indexes if they don't exist
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city_country_id ON city(country_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_area_city_id ON area(city_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_city_id ON destination(city_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_area_id ON destination(area_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_country_id ON destination(country_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_type ON destination(type)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_index_city_id ON search_index(city_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_search_index_area_id ON search_index(area_id)')
+
+# FTS5 options of country_fts, city_fts and area_fts. Prefix indexes make short
+# prefix queries such as "b*" or "ba*" read one index entry instead of expanding
+# over every matching term. FTS_TOKENIZER can be set to 'trigram' for infix
+# matches; trigram tables ignore prefix indexes and only match queries of at
+# least three characters.
+FTS_TOKENIZER = 'unicode61'
+FTS_PREFIX_LENGTHS = (1, 2, 3)
+
+# FTS table name -> (external content table, indexed columns)
+FTS_TABLES = {
+    'country_fts': ('country', 'name'),
+    'city_fts': ('city', 'name'),
+    'area_fts': ('area', 'name'),
+    'search_fts': ('search_index', 'name, parent_name')
+}
+
+# Function to build the CREATE statement of an FTS table
+def fts_table_sql(table, content_table, columns):
+    options = [f"content={content_table}", "content_rowid=id", f"tokenize='{FTS_TOKENIZER}'"]
+    if FTS_PREFIX_LENGTHS and FTS_TOKENIZER.split()[0] != 'trigram':
+        options.append(f"prefix='{' '.join(str(length) for length in FTS_PREFIX_LENGTHS)}'")
+    return f"CREATE VIRTUAL TABLE {table} USING fts5({columns}, {', '.join(options)})"
+
+# Function to create the FTS tables, migrating tables built with other options
+def create_fts_tables(cursor):
+    """Create missing FTS tables and rebuild those whose options changed.
+
+    Returns True if an existing table was rebuilt.
+    """
+    migrated = False
+    for table, (content_table, columns) in FTS_TABLES.items():
+        sql = fts_table_sql(table, content_table, columns)
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            continue
+        
+        if row:
+            cursor.execute(f'DROP TABLE {table}')
+        cursor.execute(sql)
+        if row:
+            # Re-index the external content table with the new options
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES('rebuild')")
+            migrated = True
+    return migrated
+
+# Function to build the triggers that keep an FTS table in sync with its content table
+def fts_trigger_sql(table, content_table, columns):
+    names = [column.strip() for column in columns.split(',')]
+    column_list = ', '.join(names)
+    old_values = ', '.join(f'old.{name}' for name in names)
+    new_values = ', '.join(f'new.{name}' for name in names)
+    changed = ' OR '.join(f'old.{name} IS NOT new.{name}' for name in ['id'] + names)
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {content_table} BEGIN
+            INSERT INTO {table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {content_table} BEGIN
+            INSERT INTO {table} ({table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE ON {content_table} WHEN {changed} BEGIN
+            INSERT INTO {table} ({table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {table} (rowid, {column_list}) VALUES (new.id, {new_values});
+        END'''
+    ]
+
+# Functions to create and drop the FTS sync triggers. Bulk loads run without
+# them and index the content table in one pass instead.
+def create_fts_triggers(cursor, tables=None):
+    for table in tables or FTS_TABLES:
+        for sql in fts_trigger_sql(table, *FTS_TABLES[table]):
+            cursor.execute(sql)
+
+def drop_fts_triggers(cursor, tables=None):
+    for table in tables or FTS_TABLES:
+        for event in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_{event}')
+
+# SQL to rebuild the denormalized search index. Rows get their ids in ranking
+# order (score computed with the shared weights, then hotel count), so FTS5,
+# which returns matches in rowid order, yields them already ranked and a search
+# can stop after the first 20 matches instead of sorting all of them.
+REBUILD_SEARCH_INDEX_SQL = '''
+    WITH candidates AS (
+        SELECT
+            d.id AS destination_id, ci.country_id AS country_id, ci.id AS city_id, NULL AS area_id, 'city' AS type, ci.name AS name, co.name AS parent_name,
+            co.name AS country_name, ci.name AS city_name, NULL AS area_name,
+            ci.total_hotels AS hotel_count, s.hotel_count_normalized, s.country_hotel_count_normalized,
+            s.total_score, d.country_id AS destination_country_id, co.total_hotels AS country_total_hotels
+        FROM city ci
+        LEFT JOIN country co ON ci.country_id = co.id
+        LEFT JOIN destination d ON d.city_id = ci.id AND d.type = 'city'
+        LEFT JOIN destination_score s ON d.id = s.destination_id
+        WHERE {city_where}
+        
+        UNION ALL
+        
+        SELECT
+            d.id, ci.country_id, ar.city_id, ar.id, 'area', ar.name, ci.name,
+            co.name, ci.name, ar.name,
+            ar.total_hotels, s.hotel_count_normalized, s.country_hotel_count_normalized,
+            s.total_score, d.country_id, co.total_hotels
+        FROM area ar
+        LEFT JOIN city ci ON ar.city_id = ci.id
+        LEFT JOIN country co ON ci.country_id = co.id
+        LEFT JOIN destination d ON d.area_id = ar.id AND d.type = 'area'
+        LEFT JOIN destination_score s ON d.id = s.destination_id
+        WHERE {area_where}
+    )
+    INSERT INTO search_index (
+        id, destination_id, country_id, city_id, area_id, type, name, parent_name, country_name, city_name, area_name,
+        hotel_count, hotel_count_normalized, country_hotel_count_normalized, total_score,
+        destination_country_id, country_total_hotels
+    )
+    SELECT
+        :id_offset + ROW_NUMBER() OVER (
+            ORDER BY {score} DESC, si.hotel_count DESC,
+                -- Deterministic order for ties, which PrefixTrie ranks the same way
+                si.type, si.name, si.country_name, si.city_name, si.area_name,
+                si.hotel_count_normalized, si.country_hotel_count_normalized, si.country_total_hotels
+        ),
+        si.destination_id, si.country_id, si.city_id, si.area_id, si.type, si.name, si.parent_name, si.country_name, si.city_name, si.area_name,
+        si.hotel_count, si.hotel_count_normalized, si.country_hotel_count_normalized, si.total_score,
+        si.destination_country_id, si.country_total_hotels
+    FROM candidates si
+    LEFT JOIN factor_weights w ON w.type = si.type
+'''
+
+# Function to rebuild the denormalized search index from the base tables
+def rebuild_search_index(cursor):
+    """Fill search_index with every city and area the separate FTS searches can find.
+
+    Must be called whenever the data or the shared weights change, since the
+    row order depends on both; the weights it was ordered with are recorded in
+    search_index_layout.
+    """
+    score = STORED_SCORE_SQL if SCORING_MODE == 'stored' else QUERY_TIME_SCORE_SQL
+    conn = cursor.connection
+    drop_fts_triggers(cursor, ['search_fts'])
+    execute_timed(conn, 'rebuild_search_index.delete', 'DELETE FROM search_index')
+    execute_timed(
+        conn, 'rebuild_search_index.insert',
+        REBUILD_SEARCH_INDEX_SQL.format(score=score, city_where='true', area_where='true'),
+        {'id_offset': 0}
+    )
+    execute_timed(conn, 'rebuild_search_index.fts', "INSERT INTO search_fts(search_fts) VALUES('rebuild')")
+    create_fts_triggers(cursor, ['search_fts'])
+    
+    cursor.execute('DELETE FROM search_index_layout')
+    cursor.execute('''
+        INSERT INTO search_index_layout (scoring_mode, type, hotel_count_weight, country_hotel_count_weight)
+        SELECT ?, type, hotel_count_weight, country_hotel_count_weight FROM factor_weights
+    ''', (SCORING_MODE,))
+
+# Function to check if the search index is ordered for the current shared weights
+def search_index_is_current(cursor):
+    cursor.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM search_index_layout) = (SELECT COUNT(*) FROM factor_weights)
+            AND NOT EXISTS (
+                SELECT 1
+                FROM factor_weights w
+                LEFT JOIN search_index_layout l
+                    ON l.type = w.type
+                    AND l.hotel_count_weight IS w.hotel_count_weight
+                    AND l.country_hotel_count_weight IS w.country_hotel_count_weight
+                    AND l.scoring_mode = ?
+                WHERE l.type IS NULL
+            )
+    ''', (SCORING_MODE,))
+    return bool(cursor.fetchone()[0])
+
+# Schema version of the database artifact. Bump it whenever the schema or the
+# way the data is loaded changes, so existing artifacts are rebuilt.
+SCHEMA_VERSION = 2
+DATA_DIR = 'data'
+DATA_FILES = ('country.csv', 'city.csv', 'area.csv', 'destination.csv')
+
+# Function to hash the content of a data file, cached by its size and modification time
+@st.cache_data(show_spinner=False)
+def file_content_hash(file_path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to get the hash of the settings a database is built with
+def config_hash():
+    return hashlib.sha256(json.dumps({
+        'fts_tokenizer': FTS_TOKENIZER,
+        'fts_prefix_lengths': list(FTS_PREFIX_LENGTHS),
+        'scoring_mode': SCORING_MODE
+    }, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Function to get the content hash of the data files of a database build
+def input_hash(data_dir=DATA_DIR):
+    digest = hashlib.sha256()
+    for file_name in DATA_FILES:
+        file_path = os.path.join(data_dir, file_name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            digest.update(f'{file_name}:{file_content_hash(file_path, stat.st_size, stat.st_mtime_ns)}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+# Function to read the schema version and build information of the database artifact
+def read_build_info():
+    """Return (schema_version, {key: value}), or None if there is no usable artifact"""
+    if not os.path.exists(get_connection_pool().path):
+        return None
+    try:
+        with read_connection() as conn:
+            schema_version = conn.execute('PRAGMA user_version').fetchone()[0]
+            build_info = dict(conn.execute('SELECT key, value FROM build_info').fetchall())
+    except sqlite3.Error:
+        return None  # Built before build_info existed, or not a database
+    return schema_version, build_info
+
+# Function to compare the database artifact with the current schema, settings and data files
+def database_status(data_dir=DATA_DIR):
+    """Return 'current', 'stale_data' (only the data files changed) or 'rebuild'"""
+    info = read_build_info()
+    if info is None:
+        return 'rebuild'
+    schema_version, build_info = info
+    if schema_version != SCHEMA_VERSION or build_info.get('config_hash') != config_hash():
+        return 'rebuild'
+    if build_info.get('input_hash') != input_hash(data_dir):
+        return 'stale_data'
+    return 'current'
+
+def database_is_current(data_dir=DATA_DIR):
+    return database_status(data_dir) == 'current'
+
+# Function to compile the CSV files into a new database artifact
+def build_database(data_dir=DATA_DIR, path=None):
+    """Build the database in a scratch file, then swap it in for the artifact at path.
+
+    The shared factor weights of the artifact being replaced are kept.
+    """
+    pool = get_connection_pool()
+    path = path or pool.path
+    build_path = f'{path}.build'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(build_path + suffix):
+            os.remove(build_path + suffix)
+    
+    shared_weights = {}
+    if os.path.exists(path):
+        try:
+            shared_weights = get_weights()
+        except sqlite3.Error:
+            pass
+    
+    digest = input_hash(data_dir)
+    conn = sqlite3.connect(build_path)
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+        setup_database(conn, data_dir)
+        cursor = conn.cursor()
+        
+        # Carry the shared weights over to the new artifact
+        if shared_weights:
+            cursor.executemany(
+                'UPDATE factor_weights SET hotel_count_weight = ?, country_hotel_count_weight = ? WHERE type = ?',
+                [(w['hotel_count_weight'], w['country_hotel_count_weight'], dest_type) for dest_type, w in shared_weights.items()]
+            )
+            if SCORING_MODE == 'stored':
+                calculate_scores(cursor)
+            rebuild_search_index(cursor)
+        
+        cursor.execute('CREATE TABLE build_info (key TEXT PRIMARY KEY, value TEXT)')
+        cursor.executemany('INSERT INTO build_info (key, value) VALUES (?, ?)', [
+            ('config_hash', config_hash()),
+            ('input_hash', digest),
+            ('built_at', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('sqlite_version', sqlite3.sqlite_version)
+        ])
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        cursor.execute('PRAGMA optimize')
+        # Fetch the checkpoint result, so no statement keeps the journal files open on close
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    
+    pool.swap(build_path)
+    if SHARD_REGIONS:
+        build_search_shards()
+    get_search_cache().invalidate()
+    get_prefix_trie().built = False
+    get_fuzzy_index().invalidate()
+    if SUGGESTION_SNAPSHOT:
+        compile_suggestion_snapshot()
+
+# Staging tables hold the rows a load would write, and are compared with the
+# loaded tables to find the rows a refresh has to change
+STAGING_COLUMNS = {
+    'country': ['id', 'name', 'total_hotels'],
+    'city': ['id', 'name', 'country_id', 'total_hotels'],
+    'area': ['id', 'name', 'city_id', 'total_hotels'],
+    'destination': ['id', 'name', 'country_id', 'city_id', 'area_id', 'type']
+}
+# Country hotel totals are aggregated from the cities, so only names are compared
+COMPARED_COLUMNS = dict(STAGING_COLUMNS, country=['id', 'name'])
+
+# Refreshes patch search_index in place, leaving it out of ranking order (searches
+# sort their matches instead) until the next update_weights() or rebuild. Set to
+# True to rebuild it in ranking order as part of every refresh.
+REORDER_AFTER_REFRESH = False
+
+# Function to create empty staging tables, or copies of the loaded tables
+def create_staging_tables(cursor, copy_loaded=False):
+    for table, columns in STAGING_COLUMNS.items():
+        column_list = ', '.join(columns)
+        cursor.execute(f'DROP TABLE IF EXISTS temp.staging_{table}')
+        cursor.execute(f'CREATE TEMP TABLE staging_{table} AS SELECT {column_list} FROM main.{table} WHERE false')
+        if table == 'country':
+            # Same conflict handling as the country table, whose names are unique
+            cursor.execute('CREATE UNIQUE INDEX temp.idx_staging_country_name ON staging_country(name)')
+        cursor.execute(f'CREATE UNIQUE INDEX temp.idx_staging_{table}_id ON staging_{table}(id)')
+        if copy_loaded:
+            cursor.execute(f'INSERT INTO staging_{table} SELECT {column_list} FROM main.{table}')
+
+# Function to drop the staging and change tables of a refresh
+def drop_staging_tables(cursor):
+    for table in STAGING_COLUMNS:
+        cursor.execute(f'DROP TABLE IF EXISTS temp.staging_{table}')
+        cursor.execute(f'DROP TABLE IF EXISTS temp.changed_{table}')
+    for table in ('affected_country', 'country_max_before', 'rescored_country', 'touched_destination', 'affected_city', 'affected_area'):
+        cursor.execute(f'DROP TABLE IF EXISTS temp.{table}')
+
+# Function to stage the loaded rows updated with the rows of delta CSV files
+def stage_delta_data(cursor, delta_dir, batch_size=LOAD_BATCH_SIZE):
+    """Stage the loaded tables with the rows of delta_dir upserted.
+
+    Delta files have the columns of the data files and may hold only changed
+    or added rows; destinations with is_publish = 0 are removed.
+    """
+    create_staging_tables(cursor, copy_loaded=True)
+    for file_name, parse_row, table in (
+        ('country.csv', parse_country_row, 'country'),
+        ('city.csv', parse_city_row, 'city'),
+        ('area.csv', parse_area_row, 'area')
+    ):
+        columns = STAGING_COLUMNS[table]
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+        for batch in read_csv_batches(file_name, parse_row, delta_dir, batch_size):
+            cursor.executemany(
+                f'''INSERT INTO staging_{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                ON CONFLICT(id) DO UPDATE SET {updates}''',
+                [
+                    (place.id, place.name, place.total_hotels) if table == 'country'
+                    else (place.id, place.name, place.parent_id, place.total_hotels)
+                    for place in batch
+                ]
+            )
+    
+    for batch in read_csv_batches('destination.csv', parse_destination_row, delta_dir, batch_size):
+        # Look up the names the destinations of this batch resolve to
+        lookups = {}
+        for table, key in (('country', 'country_id'), ('city', 'city_id'), ('area', 'area_id')):
+            ids = list({getattr(dest, key) for dest in batch if getattr(dest, key)})
+            lookups[table] = PlaceTable()
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor.execute(f"SELECT id, name FROM staging_{table} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                lookups[table].extend(Place(row_id, name) for row_id, name in cursor.fetchall())
+        
+        cursor.executemany(
+            'DELETE FROM staging_destination WHERE id = ?',
+            [(dest.id,) for dest in batch if dest.is_publish != 1]
+        )
+        cursor.executemany(
+            '''INSERT INTO staging_destination (id, name, country_id, city_id, area_id, type) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET name = excluded.name, country_id = excluded.country_id,
+                city_id = excluded.city_id, area_id = excluded.area_id, type = excluded.type''',
+            build_destination_rows(batch, lookups['country'], lookups['city'], lookups['area'])
+        )
+    
+    # Destination names follow renamed areas, cities and countries, as in build_destination_rows
+    cursor.execute('''
+        UPDATE staging_destination
+        SET name = resolved.name
+        FROM (
+            SELECT d.id, CASE
+                WHEN d.area_id THEN ar.name
+                WHEN d.city_id THEN ci.name
+                WHEN d.country_id THEN co.name
+            END AS name
+            FROM staging_destination d
+            LEFT JOIN staging_area ar ON ar.id = d.area_id
+            LEFT JOIN staging_city ci ON ci.id = d.city_id
+            LEFT JOIN staging_country co ON co.id = d.country_id
+        ) AS resolved
+        WHERE resolved.id = staging_destination.id
+            AND resolved.name IS NOT NULL
+            AND resolved.name IS NOT staging_destination.name
+    ''')
+
+# Function to write the differences between the staging and the loaded tables
+def apply_staged_changes(cursor):
+    """Apply the staged rows to the loaded tables and update the derived data.
+
+    FTS tables follow the changed rows through their triggers. Scores are
+    recomputed only for destinations whose own rows changed and for the
+    destinations of countries whose largest city changed, since the country
+    normalization divides by it; a changed global maximum rescales every score.
+    The affected search_index rows are replaced and appended after the existing
+    ones, so the index is marked as no longer in ranking order.
+    Returns refresh statistics.
+    """
+    conn = cursor.connection
+    stats = {}
+    for table in STAGING_COLUMNS:
+        columns = ', '.join(COMPARED_COLUMNS[table])
+        cursor.execute(f'DROP TABLE IF EXISTS temp.changed_{table}')
+        cursor.execute(f'''
+            CREATE TEMP TABLE changed_{table} AS
+            SELECT id FROM (SELECT {columns} FROM staging_{table} EXCEPT SELECT {columns} FROM main.{table})
+            UNION
+            SELECT id FROM (SELECT {columns} FROM main.{table} EXCEPT SELECT {columns} FROM staging_{table})
+        ''')
+        stats[f'changed_{table}'] = cursor.execute(f'SELECT COUNT(*) FROM changed_{table}').fetchone()[0]
+    
+    # Countries and destinations affected, with both the loaded and the staged references
+    cursor.execute('''
+        CREATE TEMP TABLE affected_country AS
+        SELECT id FROM changed_country
+        UNION SELECT country_id FROM main.city WHERE id IN (SELECT id FROM changed_city)
+        UNION SELECT country_id FROM staging_city WHERE id IN (SELECT id FROM changed_city)
+    ''')
+    cursor.execute('''
+        CREATE TEMP TABLE touched_destination AS
+        SELECT id, city_id, area_id FROM main.destination
+        WHERE id IN (SELECT id FROM changed_destination)
+            OR city_id IN (SELECT id FROM changed_city) OR area_id IN (SELECT id FROM changed_area)
+        UNION
+        SELECT id, city_id, area_id FROM staging_destination
+        WHERE id IN (SELECT id FROM changed_destination)
+            OR city_id IN (SELECT id FROM changed_city) OR area_id IN (SELECT id FROM changed_area)
+    ''')
+    global_max = cursor.execute('SELECT MAX(total_hotels) FROM city').fetchone()[0]
+    country_max_sql = '''
+        SELECT country_id, MAX(total_hotels) AS max_hotels FROM main.city
+        WHERE country_id IN (SELECT id FROM affected_country)
+        GROUP BY country_id
+    '''
+    cursor.execute(f'CREATE TEMP TABLE country_max_before AS {country_max_sql}')
+    
+    # Delete removed rows and upsert changed ones
+    for table, columns in STAGING_COLUMNS.items():
+        execute_timed(conn, f'refresh.delete_{table}', f'''
+            DELETE FROM main.{table}
+            WHERE id IN (SELECT id FROM changed_{table}) AND id NOT IN (SELECT id FROM staging_{table})
+        ''')
+        column_list = ', '.join(columns)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+        execute_timed(conn, f'refresh.upsert_{table}', f'''
+            INSERT INTO main.{table} ({column_list})
+            SELECT {column_list} FROM staging_{table} WHERE id IN (SELECT id FROM changed_{table})
+            ON CONFLICT(id) DO UPDATE SET {updates}
+        ''')
+    cursor.execute('''
+        DELETE FROM destination_score
+        WHERE destination_id IN (SELECT id FROM changed_destination)
+            AND destination_id NOT IN (SELECT id FROM main.destination)
+    ''')
+    cursor.execute('''
+        UPDATE country
+        SET total_hotels = (
+            SELECT COALESCE(SUM(city.total_hotels), 0)
+            FROM city
+            WHERE city.country_id = country.id
+        )
+        WHERE id IN (SELECT id FROM affected_country)
+    ''')
+    
+    stats['affected_countries'] = cursor.execute('SELECT COUNT(*) FROM affected_country').fetchone()[0]
+    stats['full_rescore'] = cursor.execute('SELECT MAX(total_hotels) FROM city').fetchone()[0] != global_max
+    if stats['full_rescore']:
+        calculate_scores(cursor)
+        rebuild_search_index(cursor)
+        return stats
+    
+    cursor.execute(f'''
+        CREATE TEMP TABLE rescored_country AS
+        SELECT country_id AS id FROM (
+            SELECT * FROM country_max_before EXCEPT SELECT * FROM ({country_max_sql})
+            UNION ALL
+            SELECT * FROM ({country_max_sql}) EXCEPT SELECT * FROM country_max_before
+        )
+    ''')
+    stats['rescored_countries'] = cursor.execute('SELECT COUNT(*) FROM rescored_country').fetchone()[0]
+    rescored = 'd.country_id IN (SELECT id FROM rescored_country) OR d.id IN (SELECT id FROM touched_destination)'
+    calculate_scores(cursor, destination_filter=rescored)
+    if REORDER_AFTER_REFRESH:
+        rebuild_search_index(cursor)
+        return stats
+    
+    # Replace the search rows of cities and areas whose names, parents, destinations or scores changed
+    cursor.execute(f'''
+        CREATE TEMP TABLE affected_city AS
+        SELECT id FROM changed_city
+        UNION SELECT id FROM main.city
+        WHERE country_id IN (SELECT id FROM rescored_country) OR country_id IN (SELECT id FROM changed_country)
+        UNION SELECT city_id FROM touched_destination
+        UNION SELECT d.city_id FROM main.destination d WHERE {rescored}
+    ''')
+    cursor.execute(f'''
+        CREATE TEMP TABLE affected_area AS
+        SELECT id FROM changed_area
+        UNION SELECT id FROM main.area WHERE city_id IN (SELECT id FROM affected_city)
+        UNION SELECT area_id FROM touched_destination
+        UNION SELECT d.area_id FROM main.destination d WHERE {rescored}
+    ''')
+    execute_timed(conn, 'refresh.delete_search_index', '''
+        DELETE FROM search_index
+        WHERE (type = 'city' AND city_id IN (SELECT id FROM affected_city))
+            OR (type = 'area' AND area_id IN (SELECT id FROM affected_area))
+    ''')
+    score = STORED_SCORE_SQL if SCORING_MODE == 'stored' else QUERY_TIME_SCORE_SQL
+    id_offset = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM search_index').fetchone()[0]
+    execute_timed(
+        conn, 'refresh.insert_search_index',
+        REBUILD_SEARCH_INDEX_SQL.format(
+            score=score,
+            city_where='ci.id IN (SELECT id FROM affected_city)',
+            area_where='ar.id IN (SELECT id FROM affected_area)'
+        ),
+        {'id_offset': id_offset}
+    )
+    stats['search_rows'] = cursor.execute('SELECT COUNT(*) FROM search_index WHERE id > ?', (id_offset,)).fetchone()[0]
+    
+    # Other rows of the affected countries only show a new country total
+    execute_timed(conn, 'refresh.update_search_index', '''
+        UPDATE search_index
+        SET country_total_hotels = co.total_hotels
+        FROM country co
+        WHERE co.id = search_index.country_id
+            AND search_index.country_id IN (SELECT id FROM affected_country)
+            AND search_index.country_total_hotels IS NOT co.total_hotels
+    ''')
+    cursor.execute('DELETE FROM search_index_layout')
+    return stats
+
+# Function to refresh the loaded data in place from changed CSV files or a delta directory
+def refresh_data(data_dir=DATA_DIR, delta_dir=None):
+    """Apply changed, added and unpublished rows without rebuilding the database.
+
+    Without delta_dir the CSV files in data_dir are staged exactly as a full load
+    would write them and compared with the loaded rows, and the artifact records
+    their input hash afterwards. Returns refresh statistics.
+    """
+    start_time = time.perf_counter()
+    with timed('refresh_data'), write_connection() as conn:
+        cursor = conn.cursor()
+        if delta_dir is None:
+            create_staging_tables(cursor)
+            ingest_csv_data(cursor, data_dir, table_prefix='temp.staging_')
+        else:
+            stage_delta_data(cursor, delta_dir)
+        stats = apply_staged_changes(cursor)
+        drop_staging_tables(cursor)
+        if delta_dir is None:
+            cursor.execute("UPDATE build_info SET value = ? WHERE key = 'input_hash'", (input_hash(data_dir),))
+        cursor.execute(
+            "INSERT OR REPLACE INTO build_info (key, value) VALUES ('refreshed_at', ?)",
+            (time.strftime('%Y-%m-%dT%H:%M:%S'),)
+        )
+        cursor.execute("DELETE FROM build_info WHERE key = 'suggestion_token'")
+    
+    if SHARD_REGIONS:
+        build_search_shards()
+    get_search_cache().invalidate()
+    get_prefix_trie().built = False
+    get_fuzzy_index().invalidate()
+    if SUGGESTION_SNAPSHOT:
+        compile_suggestion_snapshot()
+    stats['seconds'] = time.perf_counter() - start_time
+    return stats
+
 # Function to initialize the SQLite database
-def init_database():
-    conn = sqlite3.connect('destinations.db')
+def init_database(data_dir=DATA_DIR):
+    """Refresh or rebuild the database artifact if it is out of date.
+
+    Changed data files are applied in place; a new schema version or other
+    build settings rebuild the artifact. Region shards and the suggestion
+    snapshot are rebuilt with it.
+    """
+    with timed('init_database'):
+        if database_status(data_dir) == 'current':
+            # Shards built for other regions, or by a process that stopped halfway
+            if SHARD_REGIONS and not search_shards_are_current():
+                build_search_shards()
+            if SUGGESTION_SNAPSHOT and not suggestion_snapshot_is_current():
+                compile_suggestion_snapshot()
+            return
+        # Sessions that find the artifact out of date at the same time share one reload
+        write_queue = get_write_queue()
+        if get_script_run_ctx(suppress_warning=True) is None:
+            write_queue.run(('reload', data_dir), reload_database, data_dir)
+        else:
+            write_queue.wait(write_queue.submit(('reload', data_dir), reload_database, data_dir))
+
+# Function to refresh or rebuild an out-of-date database artifact, on the writer thread
+def reload_database(data_dir=DATA_DIR):
+    with get_connection_pool().exclusive():
+        # Another session may have updated it while this one waited
+        status = database_status(data_dir)
+        if status == 'stale_data':
+            try:
+                refresh_data(data_dir)
+                return
+            except Exception as e:
+                print(f"Error refreshing data, rebuilding the database: {e}")
+        if status != 'current':
+            build_database(data_dir)
+
+# Function to get a cheap signature of the data files from their sizes and modification times
+def data_files_signature(data_dir=DATA_DIR):
+    signature = []
+    for file_name in DATA_FILES:
+        try:
+            stat = os.stat(os.path.join(data_dir, file_name))
+            signature.append((file_name, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            signature.append((file_name, None, None))
+    return tuple(signature)
+
+# Function to initialize the database once per process and version of the data files
+@st.cache_resource(max_entries=1, show_spinner=False)
+def prepare_database(data_dir, signature):
+    """Run init_database() on the first run of a process and after the data files changed.
+
+    Every interaction reruns main(), and reruns only compare the data file
+    signature instead of hashing the files and reading the build information.
+    """
+    init_database(data_dir)
+    return signature
+
+# Function to import pandas in the background once per process. Only the
+# results tables need it, so the first page does not wait for the import.
+@st.cache_resource(show_spinner=False)
+def preload_pandas():
+    thread = threading.Thread(target=importlib.import_module, args=('pandas',), name='preload-pandas', daemon=True)
+    thread.start()
+    return thread
+
+# Function to create the schema and load the data into an empty database
+def setup_database(conn, data_dir=DATA_DIR):
     cursor = conn.cursor()
 
     # Create the country table
@@ -181,181 +1333,92 @@ def init_database():
         )
     ''')
     
-    # Create index on total_score for faster sorting in search results
+    # Create the denormalized search table: one row per searchable city and area,
+    # with the names it is found by and everything a search result displays
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_destination_score_total_score 
-        ON destination_score(total_score DESC)
+        CREATE TABLE IF NOT EXISTS search_index (
+            id INTEGER PRIMARY KEY,
+            destination_id INTEGER,
+            country_id INTEGER,
+            city_id INTEGER,
+            area_id INTEGER,  -- country, city and area the row was built from, for incremental refreshes
+            type TEXT,
+            name TEXT,
+            parent_name TEXT,  -- country name for cities, city name for areas
+            country_name TEXT,
+            city_name TEXT,
+            area_name TEXT,
+            hotel_count INTEGER,
+            hotel_count_normalized INTEGER,
+            country_hotel_count_normalized INTEGER,
+            total_score REAL,
+            destination_country_id INTEGER,
+            country_total_hotels INTEGER
+        )
     ''')
     
-    # Create necessary indexes if they don't exist
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city_country_id ON city(country_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_area_city_id ON area(city_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_city_id ON destination(city_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_area_id ON destination(area_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_country_id ON destination(country_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_destination_type ON destination(type)')
-
-    # Create separate FTS5 virtual tables for countries, cities and areas
+    # Create the table of the weights the search index rows are ordered by
     cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS country_fts USING fts5(name, content=country, content_rowid=id)
+        CREATE TABLE IF NOT EXISTS search_index_layout (
+            scoring_mode TEXT,
+            type TEXT PRIMARY KEY,
+            hotel_count_weight REAL,
+            country_hotel_count_weight REAL
+        )
     ''')
     
-    cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS city_fts USING fts5(name, content=city, content_rowid=id)
-    ''')
+    # Create separate FTS5 virtual tables for countries, cities and areas, and the search index
+    if create_fts_tables(cursor):
+        get_search_cache().invalidate()
     
-    cursor.execute('''
-        CREATE VIRTUAL TABLE IF NOT EXISTS area_fts USING fts5(name, content=area, content_rowid=id)
-    ''')
+    # Create the vocabulary table of the search index, used to build the prefix trie
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_vocab USING fts5vocab(search_fts, 'instance')")
 
     # Insert data from CSV files if the table is empty
     cursor.execute('SELECT COUNT(*) FROM destination')
-    if cursor.fetchone()[0] == 0:
-        # Create a placeholder for status message
-        loading_placeholder = None
-        if 'st' in globals():
-            loading_placeholder = st.empty()
-            loading_placeholder.write("Loading data from CSV files...")
-        else:
-            print("Loading data from CSV files...")
+    destination_count = cursor.fetchone()[0]
+    
+    # Rebuild the search index of databases loaded before it existed, or ordered
+    # for other weights or another scoring mode
+    if destination_count > 0:
+        create_fts_triggers(cursor)
+        if not search_index_is_current(cursor):
+            rebuild_search_index(cursor)
+            conn.commit()
+            get_search_cache().invalidate()
+    
+    if destination_count == 0:
+        # Loads run on the writer thread, which reports progress to the waiting sessions
+        write_queue = get_write_queue()
+        write_queue.report('write', "Loading data from CSV files...")
         
-        # Load data from CSV files
+        # Load-time pragmas: skip fsyncs of the WAL and use a larger page cache while the
+        # whole load runs as a single transaction (delete destinations.db if a load crashes)
+        conn.commit()
+        cursor.execute('PRAGMA synchronous = OFF')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('PRAGMA cache_size = -65536')
+        
+        # Stream data from CSV files
         try:
-            countries_data, cities_data, areas_data, destinations_data = load_csv_data()
+            load_stats = ingest_csv_data(cursor, data_dir)
         except Exception as e:
-            error_msg = f"Error loading CSV data: {e}"
-            if 'st' in globals() and loading_placeholder:
-                loading_placeholder.error(error_msg)
-            else:
-                print(error_msg)
-            countries_data, cities_data, areas_data, destinations_data = {}, {}, {}, []
+            write_queue.report('error', f"Error loading CSV data: {e}")
+            conn.rollback()
+            load_stats = ingest_csv_data(cursor, data_dir=None)
         
-        if not countries_data:
-            sample_msg = "No country data found, using sample data..."
-            if 'st' in globals() and loading_placeholder:
-                loading_placeholder.write(sample_msg)
-            else:
-                print(sample_msg)
-            # Fallback to sample data if CSV files are not available
-            countries_data = {
-                1: {'name': 'France', 'total_hotels': 0},
-                2: {'name': 'United Kingdom', 'total_hotels': 0},
-                3: {'name': 'United States', 'total_hotels': 0},
-                4: {'name': 'Japan', 'total_hotels': 0}
-            }
-            cities_data = {
-                1: {'name': 'Paris', 'country_id': 1, 'total_hotels': 320},
-                2: {'name': 'London', 'country_id': 2, 'total_hotels': 270},
-                3: {'name': 'New York', 'country_id': 3, 'total_hotels': 420},
-                4: {'name': 'Tokyo', 'country_id': 4, 'total_hotels': 380}
-            }
-            areas_data = {
-                1: {'name': 'Eiffel Tower', 'city_id': 1, 'total_hotels': 35},
-                2: {'name': 'Buckingham Palace', 'city_id': 2, 'total_hotels': 15},
-                3: {'name': 'Central Park', 'city_id': 3, 'total_hotels': 50},
-                4: {'name': 'Shibuya Crossing', 'city_id': 4, 'total_hotels': 25}
-            }
+        if load_stats['sample_data']:
+            write_queue.report('write', "No country data found, using sample data...")
         else:
-            success_msg = f"Loaded {len(countries_data)} countries, {len(cities_data)} cities, {len(areas_data)} areas, {len(destinations_data)} destinations"
-            if 'st' in globals() and loading_placeholder:
-                loading_placeholder.success(success_msg)
-            else:
-                print(success_msg)
-        
-        # Insert countries
-        for country_id, country_info in countries_data.items():
-            cursor.execute(
-                'INSERT OR IGNORE INTO country (id, name, total_hotels) VALUES (?, ?, ?)',
-                (country_id, country_info['name'], country_info['total_hotels'])
-            )
-        
-        # Insert cities
-        for city_id, city_info in cities_data.items():
-            cursor.execute(
-                'INSERT OR IGNORE INTO city (id, name, country_id, total_hotels) VALUES (?, ?, ?, ?)',
-                (city_id, city_info['name'], city_info['country_id'], city_info['total_hotels'])
+            success_msg = (
+                f"Loaded {load_stats['countries']} countries, {load_stats['cities']} cities, "
+                f"{load_stats['areas']} areas, {load_stats['destinations']} destinations "
+                f"in {load_stats['seconds']:.2f}s ({load_stats['rows_per_second']:,.0f} rows/s)"
             )
+            write_queue.report('success', success_msg)
         
-        # Insert areas
-        for area_id, area_info in areas_data.items():
-            cursor.execute(
-                'INSERT OR IGNORE INTO area (id, name, city_id, total_hotels) VALUES (?, ?, ?, ?)',
-                (area_id, area_info['name'], area_info['city_id'], area_info['total_hotels'])
-            )
-        
-        # Process destinations from CSV or create from cities/areas
-        destinations_to_insert = []
-        
-        if destinations_data:
-            # Use destinations from CSV file
-            for dest in destinations_data:
-                if dest['is_publish'] == 1:  # Only published destinations
-                    if dest['area_id']:
-                        # Area destination
-                        area_info = areas_data.get(dest['area_id'])
-                        if area_info:
-                            destinations_to_insert.append((
-                                dest['id'],
-                                area_info['name'],
-                                dest['country_id'],
-                                dest['city_id'],
-                                dest['area_id'],
-                                'area'
-                            ))
-                    elif dest['city_id']:
-                        # City destination
-                        city_info = cities_data.get(dest['city_id'])
-                        if city_info:
-                            destinations_to_insert.append((
-                                dest['id'],
-                                city_info['name'],
-                                dest['country_id'],
-                                dest['city_id'],
-                                None,
-                                'city'
-                            ))
-                    elif dest['country_id']:
-                        # Country-only destination (treat as city)
-                        country_info = countries_data.get(dest['country_id'])
-                        if country_info:
-                            destinations_to_insert.append((
-                                dest['id'],
-                                country_info['name'],
-                                dest['country_id'],
-                                None,
-                                None,
-                                'city'
-                            ))
-        else:
-            # Create destinations from cities and areas if no destination CSV
-            for city_id, city_info in cities_data.items():
-                destinations_to_insert.append((
-                    city_id,
-                    city_info['name'],
-                    city_info['country_id'],
-                    city_id,
-                    None,
-                    'city'
-                ))
-            
-            for area_id, area_info in areas_data.items():
-                city_info = cities_data.get(area_info['city_id'])
-                if city_info:
-                    destinations_to_insert.append((
-                        area_id + 10000,  # Offset to avoid ID conflicts
-                        area_info['name'],
-                        city_info['country_id'],
-                        area_info['city_id'],
-                        area_id,
-                        'area'
-                    ))
-        
-        # Insert destinations
-        for dest_data in destinations_to_insert:
-            cursor.execute(
-                'INSERT OR IGNORE INTO destination (id, name, country_id, city_id, area_id, type) VALUES (?, ?, ?, ?, ?, ?)',
-                dest_data
-            )
+        # Create indexes after the data is loaded, so the load does not maintain them row by row
+        create_indexes(cursor)
         
         # Update country total_hotels with aggregated hotel counts from their cities
         cursor.execute('''
@@ -371,6 +1434,7 @@ def init_database():
         cursor.execute('INSERT INTO country_fts (rowid, name) SELECT id, name FROM country')
         cursor.execute('INSERT INTO city_fts (rowid, name) SELECT id, name FROM city')
         cursor.execute('INSERT INTO area_fts (rowid, name) SELECT id, name FROM area')
+        create_fts_triggers(cursor)
         
         # Set default weights with two-factor weighting (no rating)
         city_hotel_count_weight = 0.8  # Global hotel count weight for cities
@@ -385,329 +1449,2021 @@ def init_database():
         ]
         cursor.executemany('INSERT INTO factor_weights (type, hotel_count_weight, country_hotel_count_weight) VALUES (?, ?, ?)', default_weights)
         
-        # Calculate normalized hotel counts and scores
-        # First, get the maximum city hotel count for normalization
-        cursor.execute('SELECT MAX(total_hotels) FROM city')
-        result = cursor.fetchone()
-        max_city_hotels = result[0] if result and result[0] else 1  # Avoid division by zero
-        
-        # Create scores with normalized hotel counts from location tables
-        scores = []
-        
-        # Get all destinations for scoring
-        cursor.execute('SELECT id, type, country_id FROM destination')
-        destinations = cursor.fetchall()
-        
-        for dest_id, dest_type, country_id in destinations:
-            # Get hotel count from appropriate location table
-            if dest_type == 'city':
-                cursor.execute('''
-                    SELECT ci.total_hotels 
-                    FROM destination d 
-                    JOIN city ci ON d.city_id = ci.id 
-                    WHERE d.id = ?
-                ''', (dest_id,))
-                result = cursor.fetchone()
-                hotel_count = result[0] if result else 0
-                # Normalize city hotel count: city.total_hotels / max(city.total_hotels)
-                hotel_count_normalized = int((hotel_count / max_city_hotels) * 100)
-                
-                # Get max hotel count within the same country for country normalization
-                cursor.execute('''
-                    SELECT MAX(ci.total_hotels) 
-                    FROM city ci 
-                    WHERE ci.country_id = ?
-                ''', (country_id,))
-                result = cursor.fetchone()
-                max_country_city_hotels = result[0] if result and result[0] else 1
-                country_hotel_count_normalized = int((hotel_count / max_country_city_hotels) * 100) if max_country_city_hotels > 200 else 0
-            else:  # area
-                cursor.execute('''
-                    SELECT ar.total_hotels 
-                    FROM destination d 
-                    JOIN area ar ON d.area_id = ar.id 
-                    WHERE d.id = ?
-                ''', (dest_id,))
-                result = cursor.fetchone()
-                hotel_count = result[0] if result else 0
-                # Normalize area hotel count: area.total_hotels / max(city.total_hotels)
-                hotel_count_normalized = int((hotel_count / max_city_hotels) * 100)
-                
-                # Get max hotel count within the same country for country normalization
-                cursor.execute('''
-                    SELECT MAX(ci.total_hotels) 
-                    FROM city ci 
-                    WHERE ci.country_id = ?
-                ''', (country_id,))
-                result = cursor.fetchone()
-                max_country_city_hotels = result[0] if result and result[0] else 1
-                country_hotel_count_normalized = int((hotel_count / max_country_city_hotels) * 100) if max_country_city_hotels > 200 else 0
-            
-            # Get weights for this destination type
-            if dest_type == 'city':
-                hotel_count_weight = city_hotel_count_weight
-                country_hotel_count_weight = city_country_hotel_count_weight
-            else:  # area
-                hotel_count_weight = area_hotel_count_weight
-                country_hotel_count_weight = area_country_hotel_count_weight
-            
-            # Calculate weighted total score with two factors (no rating)
-            weighted_sum = (hotel_count_normalized * hotel_count_weight) + (country_hotel_count_normalized * country_hotel_count_weight)
-            factor_count = 2
-            
-            # Boost score for Thailand
-            boost_up = 3 * factor_count if country_id == 106 else 1
-            
-            total_score = weighted_sum * boost_up / factor_count if factor_count > 0 else 0
-            
-            scores.append((
-                dest_id, 
-                hotel_count_normalized,
-                country_hotel_count_normalized,
-                total_score
-            ))
+        # Calculate normalized hotel counts and scores for every destination in one pass
+        calculate_scores(cursor)
         
-        # Insert scores with both hotel count normalizations (no rating)
-        cursor.executemany('''
-            INSERT INTO destination_score (
-                destination_id, hotel_count_normalized, country_hotel_count_normalized, total_score
-            ) VALUES (?, ?, ?, ?)
-        ''', scores)
+        # Build the search index from the loaded data
+        rebuild_search_index(cursor)
 
-        # Clear the loading message after loading is complete
-        if 'st' in globals() and loading_placeholder:
-            loading_placeholder.empty()
+        # Commit the load and restore the connection settings
+        conn.commit()
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+        get_search_cache().invalidate()
+        get_prefix_trie().built = False
+        get_fuzzy_index().invalidate()
 
-    conn.commit()
-    conn.close()
+# Scoring mode: 'stored' keeps destination_score.total_score up to date for the
+# shared weights, 'query_time' only relies on the stored normalized factors and
+# combines them with the weights when search_destinations runs, so updating the
+# weights never rewrites destination_score.
+SCORING_MODE = 'query_time'
 
-# Function to connect to the database
-def get_connection():
-    return sqlite3.connect('destinations.db')
+# Set-based scoring: the global max, the per-country max and both normalized
+# factors are computed by SQLite in a single statement instead of per row.
+# Destinations of the country with SCORE_BOOST_COUNTRY_ID get their score boosted,
+# and country normalization only applies when the country's largest city has more
+# than COUNTRY_NORMALIZATION_MIN_HOTELS hotels.
+SCORE_BOOST_COUNTRY_ID = 106  # Thailand
+SCORE_FACTOR_COUNT = 2
+COUNTRY_NORMALIZATION_MIN_HOTELS = 200
 
-# Function to update factor weights and recalculate total score
-def update_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
-    conn = get_connection()
-    cursor = conn.cursor()
+SCORE_SQL = '''
+    WITH global_max AS (
+        SELECT COALESCE(NULLIF(MAX(total_hotels), 0), 1) AS max_hotels FROM city
+    ),
+    country_max AS (
+        SELECT country_id, COALESCE(NULLIF(MAX(total_hotels), 0), 1) AS max_hotels
+        FROM city
+        GROUP BY country_id
+    ),
+    hotel_counts AS (
+        SELECT
+            d.id,
+            d.type,
+            d.country_id,
+            COALESCE(CASE WHEN d.type = 'city' THEN ci.total_hotels ELSE ar.total_hotels END, 0) AS hotel_count,
+            COALESCE(cm.max_hotels, 1) AS max_country_hotels
+        FROM destination d
+        LEFT JOIN city ci ON d.type = 'city' AND ci.id = d.city_id
+        LEFT JOIN area ar ON d.type != 'city' AND ar.id = d.area_id
+        LEFT JOIN country_max cm ON cm.country_id = d.country_id
+        WHERE {where}
+    ),
+    normalized AS (
+        SELECT
+            hc.id,
+            hc.type,
+            hc.country_id,
+            CAST(CAST(hc.hotel_count AS REAL) / gm.max_hotels * 100 AS INTEGER) AS hotel_count_normalized,
+            CASE WHEN hc.max_country_hotels > :min_country_hotels
+                THEN CAST(CAST(hc.hotel_count AS REAL) / hc.max_country_hotels * 100 AS INTEGER)
+                ELSE 0
+            END AS country_hotel_count_normalized
+        FROM hotel_counts hc, global_max gm
+    )
+    INSERT INTO destination_score (
+        destination_id, hotel_count_normalized, country_hotel_count_normalized, total_score
+    )
+    SELECT
+        n.id,
+        n.hotel_count_normalized,
+        n.country_hotel_count_normalized,
+        (n.hotel_count_normalized * w.hotel_count_weight
+            + n.country_hotel_count_normalized * w.country_hotel_count_weight)
+            * (CASE WHEN n.country_id = :boost_country_id THEN 3 * :factor_count ELSE 1 END)
+            / CAST(:factor_count AS REAL)
+    FROM normalized n
+    JOIN factor_weights w ON w.type = (CASE WHEN n.type = 'city' THEN 'city' ELSE 'area' END)
+    WHERE true
+    ON CONFLICT(destination_id) DO UPDATE SET
+        hotel_count_normalized = excluded.hotel_count_normalized,
+        country_hotel_count_normalized = excluded.country_hotel_count_normalized,
+        total_score = excluded.total_score
+'''
+
+# Function to calculate destination scores
+def calculate_scores(cursor, dest_type=None, destination_filter=None):
+    """Calculate normalized hotel counts and total scores with set-based SQL.
+
+    Scores all destinations when dest_type is None, otherwise only destinations
+    of that type which have a country (the rows update_weights has always rescored).
+    destination_filter is an SQL condition on destination d that limits the
+    rescored rows further, e.g. to the countries a refresh touched.
+    """
+    params = {
+        'min_country_hotels': COUNTRY_NORMALIZATION_MIN_HOTELS,
+        'boost_country_id': SCORE_BOOST_COUNTRY_ID,
+        'factor_count': SCORE_FACTOR_COUNT,
+    }
+    if dest_type is None:
+        where = 'true'
+    else:
+        where = 'd.type = :dest_type AND d.country_id IS NOT NULL'
+        params['dest_type'] = dest_type
+    if destination_filter:
+        where = f'({where}) AND ({destination_filter})'
+    execute_timed(cursor.connection, 'calculate_scores', SCORE_SQL.format(where=where), params)
+
+# Connection settings applied once to every pooled connection
+DB_PATH = 'destinations.db'
+READ_POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 32 * 1024
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024  # Bytes the WAL is truncated to after a checkpoint
+
+# Pool of long-lived connections: read connections are checked out one thread at a
+# time, while all writes go through a single dedicated writer connection. Since the
+# sqlite3 module caches prepared statements per connection by SQL text, reusing a
+# connection also reuses the prepared search statement.
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=READ_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._readers = queue.LifoQueue()  # LIFO hands out the most recently used (warmest) connection
+        self._reader_count = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.RLock()
     
+    def _connect(self, read_only):
+        if read_only:
+            # Readers open the artifact read-only; its WAL journal mode is persistent
+            uri = f'file:{quote(os.path.abspath(self.path))}?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            # A swap writes the whole database through the WAL; truncate it again afterwards
+            conn.execute(f'PRAGMA journal_size_limit = {JOURNAL_SIZE_LIMIT}')
+        try:
+            conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+            conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return conn
+    
+    @contextmanager
+    def reader(self):
+        """Check out a read connection, opening a new one while the pool is below its size"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._reader_count < self.size
+                if can_open:
+                    self._reader_count += 1
+            if not can_open:
+                conn = self._readers.get()
+            else:
+                try:
+                    conn = self._connect(read_only=True)
+                except BaseException:
+                    # Give the slot back, or every failed open would shrink the pool for good
+                    with self._lock:
+                        self._reader_count -= 1
+                    raise
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+    
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection, committing on success and rolling back on error"""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+    
+    @contextmanager
+    def exclusive(self):
+        """Hold the writer lock without using the writer connection"""
+        with self._writer_lock:
+            yield
+    
+    def swap(self, new_path):
+        """Copy the database at new_path into the live file, then delete new_path.
+
+        The copy is one write transaction on the live file made with SQLite's
+        backup API, so the file, its WAL and the connections of this and other
+        processes stay valid: reads in progress finish on the old snapshot and
+        the next read sees the new database.
+        """
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(read_only=False)
+            source = sqlite3.connect(new_path)
+            try:
+                source.backup(self._writer)
+            finally:
+                source.close()
+            # Copy the new pages back from the WAL without waiting for readers
+            self._writer.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(new_path + suffix):
+                os.remove(new_path + suffix)
+
+# Function to get the process-wide connection pool, shared across Streamlit reruns and sessions
+# (process-wide getters show no spinner, since the writer thread, which has no
+# Streamlit session to show one in, may be the first to call them)
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(path=DB_PATH):
+    return ConnectionPool(path)
+
+# Functions to borrow a connection from the pool
+def read_connection():
+    return get_connection_pool().reader()
+
+def write_connection():
+    return get_connection_pool().writer()
+
+WRITE_STATUS_INTERVAL = 0.1  # Seconds between checks for progress while a session waits on the writer
+
+# Single writer for the app's mutations. Weight updates and data reloads from
+# all sessions are queued and applied one at a time on a dedicated thread, so
+# they never interleave, while searches keep reading their WAL snapshot on the
+# read-only connections. A mutation submitted while another with the same key
+# is still waiting replaces it, so only the latest weights of a type are
+# applied, and both submitters get the result of the one that ran. The writer
+# thread has no Streamlit session to draw in, so a mutation reports progress
+# with report(), and the sessions waiting on it show the messages.
+class WriteQueue:
+    def __init__(self):
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_depth = 0
+        self.running = None
+        self.status = None  # (kind, message) last reported by the running mutation
+        self._pending = OrderedDict()  # key -> [func, args, future, submit time], in submission order
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def submit(self, key, func, *args):
+        """Queue func(*args) under key, whose first item names the operation, and return a Future of its result"""
+        with self._condition:
+            self.submitted += 1
+            task = self._pending.get(key)
+            if task is not None:
+                # Keeps the place and waiting time of the earlier submission
+                task[0], task[1] = func, args
+                self.coalesced += 1
+                return task[2]
+            future = Future()
+            self._pending[key] = [func, args, future, time.perf_counter()]
+            self.peak_depth = max(self.peak_depth, len(self._pending))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='writer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+            return future
+    
+    def run(self, key, func, *args):
+        """Apply func(*args) on the writer thread and return its result"""
+        if threading.current_thread() is self._thread:
+            # Mutations started by a queued mutation are serialized with it already
+            return func(*args)
+        return self.submit(key, func, *args).result()
+    
+    def report(self, kind, message):
+        """Print a progress message of the running mutation; kind is 'write', 'success' or 'error'"""
+        print(message)
+        self.status = (kind, message)
+    
+    def wait(self, future):
+        """Wait for a submitted mutation on a Streamlit script thread, showing its progress messages"""
+        placeholder = st.empty()
+        shown = None
+        while not future.done():
+            status = self.status
+            if status is not None and status != shown:
+                kind, message = status
+                getattr(placeholder, kind)(message)
+                shown = status
+            time.sleep(WRITE_STATUS_INTERVAL)
+        placeholder.empty()
+        return future.result()
+    
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                key, (func, args, future, submitted_at) = self._pending.popitem(last=False)
+                self.running = key[0]
+                self.status = None
+            get_query_metrics().record('write_queue.wait', time.perf_counter() - submitted_at)
+            try:
+                result = func(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                failed = True
+            else:
+                future.set_result(result)
+                failed = False
+            with self._condition:
+                self.running = None
+                self.failed += failed
+                self.completed += not failed
+    
+    def stats(self):
+        with self._condition:
+            return {
+                'depth': len(self._pending),
+                'peak_depth': self.peak_depth,
+                'running': self.running,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+# Function to get the process-wide write queue
+@st.cache_resource(show_spinner=False)
+def get_write_queue():
+    return WriteQueue()
+
+# Query instrumentation settings
+SLOW_QUERY_MS = 100  # Statements slower than this are written to the slow query log
+SLOW_QUERY_LOG = 'slow_queries.log'
+SLOW_QUERY_LOG_BYTES = 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+EXPLAIN_SAMPLE_RATE = 0.01  # Share of statements whose EXPLAIN QUERY PLAN is captured
+METRICS_WINDOW = 1000  # Recent latencies kept per operation for percentiles
+PROGRESS_STEPS = 100  # SQLite VM instructions between progress handler calls
+
+# Latency, row and plan metrics of named operations. SQLite does not report
+# rows scanned to Python, so the number of virtual machine steps (counted with
+# a progress handler) stands in for the work a statement did.
+class QueryMetrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+            self._plans = {}
+            self._slow_queries = deque(maxlen=100)
+    
+    def record(self, operation, seconds, rows=None, steps=None):
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = {
+                    'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'vm_steps': 0,
+                    'latencies': deque(maxlen=self.window)
+                }
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows'] += rows or 0
+            stats['vm_steps'] += steps or 0
+            stats['latencies'].append(seconds)
+    
+    def record_plan(self, operation, sql, plan):
+        with self._lock:
+            self._plans[operation] = {'sql': sql, 'plan': plan, 'captured_at': time.time()}
+    
+    def has_plan(self, operation):
+        return operation in self._plans
+    
+    def record_slow_query(self, entry):
+        with self._lock:
+            self._slow_queries.append(entry)
+    
+    def snapshot(self):
+        """Return all metrics as a JSON-serializable dictionary"""
+        with self._lock:
+            operations = {}
+            for operation, stats in sorted(self._operations.items()):
+                latencies = sorted(stats['latencies'])
+                percentile = lambda p: latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))] * 1000
+                operations[operation] = {
+                    'calls': stats['calls'],
+                    'mean_ms': stats['seconds'] / stats['calls'] * 1000,
+                    'p50_ms': percentile(50),
+                    'p95_ms': percentile(95),
+                    'p99_ms': percentile(99),
+                    'max_ms': stats['max_seconds'] * 1000,
+                    'rows_per_call': stats['rows'] / stats['calls'],
+                    'vm_steps_per_call': stats['vm_steps'] / stats['calls']
+                }
+            return {
+                'operations': operations,
+                'plans': dict(self._plans),
+                'slow_queries': list(self._slow_queries)
+            }
+
+# Function to get the process-wide query metrics
+@st.cache_resource(show_spinner=False)
+def get_query_metrics():
+    return QueryMetrics()
+
+# Function to get the rotating slow query log, created on the first slow query
+@st.cache_resource(show_spinner=False)
+def get_slow_query_logger():
+    logger = logging.getLogger('destinations.slow_queries')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    return logger
+
+# Function to time a block of code that does not run SQL itself
+@contextmanager
+def timed(operation):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        get_query_metrics().record(operation, time.perf_counter() - start)
+
+# Function to run a statement while recording its latency, rows and work,
+# a sampled query plan and, if it is slow, a slow query log entry
+def execute_timed(conn, operation, sql, params=(), deadline=None):
+    """Execute sql on conn and return the fetched rows.
+    
+    A statement still running at deadline (a time.perf_counter() value) is
+    interrupted with sqlite3.OperationalError.
+    """
+    metrics = get_query_metrics()
+    if not metrics.has_plan(operation) or random.random() < EXPLAIN_SAMPLE_RATE:
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        metrics.record_plan(operation, ' '.join(sql.split()), [
+            {'id': row[0], 'parent': row[1], 'detail': row[3]} for row in plan
+        ])
+    
+    steps = [0]
+    def count_steps():
+        steps[0] += 1
+        return deadline is not None and time.perf_counter() > deadline
+    
+    changes = conn.total_changes
+    conn.set_progress_handler(count_steps, PROGRESS_STEPS)
+    start = time.perf_counter()
+    try:
+        cursor = conn.execute(sql, params)
+        rows = cursor.fetchall()
+    finally:
+        seconds = time.perf_counter() - start
+        conn.set_progress_handler(None, 0)
+    
+    # Statements starting with WITH report no rowcount, so count changed rows instead
+    row_count = len(rows) if cursor.description else conn.total_changes - changes
+    metrics.record(operation, seconds, row_count, steps[0] * PROGRESS_STEPS)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'operation': operation,
+            'ms': round(seconds * 1000, 3),
+            'rows': row_count,
+            'vm_steps': steps[0] * PROGRESS_STEPS,
+            'sql': ' '.join(sql.split()),
+            'params': params if isinstance(params, dict) else list(params)
+        }
+        metrics.record_slow_query(entry)
+        get_slow_query_logger().info(json.dumps(entry, default=str))
+    return rows
+
+# Function to check new factor weights
+def valid_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
     # Validate weights (should be between 0 and 1)
     if not (0 <= hotel_count_weight <= 1 and 0 <= country_hotel_count_weight <= 1):
-        conn.close()
         return False
     
     # Validate destination type
-    if dest_type not in ['city', 'area']:
-        conn.close()
+    return dest_type in ['city', 'area']
+
+# Function to update factor weights and recalculate total score
+def update_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
+    """Apply new shared weights through the write queue and return True, or False if they are invalid"""
+    if not valid_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
         return False
+    return get_write_queue().run(
+        ('update_weights', dest_type), apply_weights, dest_type, hotel_count_weight, country_hotel_count_weight
+    )
+
+# Function to queue new factor weights without waiting for them
+def submit_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
+    """Return a Future of update_weights(), or None if the weights are invalid.
+
+    If newer weights of the same type are submitted before these are applied,
+    only the newer ones are written and both futures resolve together.
+    """
+    if not valid_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
+        return None
+    return get_write_queue().submit(
+        ('update_weights', dest_type), apply_weights, dest_type, hotel_count_weight, country_hotel_count_weight
+    )
+
+# Function to write factor weights and recalculate total score, on the writer thread
+def apply_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
+    with timed('update_weights'), write_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Update the weights for the specified destination type
+        execute_timed(conn, 'update_weights.factor_weights', '''
+            UPDATE factor_weights
+            SET hotel_count_weight = ?,
+                country_hotel_count_weight = ?
+            WHERE type = ?
+        ''', (hotel_count_weight, country_hotel_count_weight, dest_type))
+        
+        # Recalculate the stored scores of the specified type with the new weights
+        if SCORING_MODE == 'stored':
+            calculate_scores(cursor, dest_type)
+        
+        # Reorder the search index for the new shared weights
+        rebuild_search_index(cursor)
+        # The suggestion snapshot holds results for the old weights
+        cursor.execute("DELETE FROM build_info WHERE key = 'suggestion_token'")
     
-    # Update the weights for the specified destination type
-    cursor.execute('''
-        UPDATE factor_weights
-        SET hotel_count_weight = ?,
-            country_hotel_count_weight = ?
-        WHERE type = ?
-    ''', (hotel_count_weight, country_hotel_count_weight, dest_type))
-    
-    # Get max city hotel count for normalization
-    cursor.execute('SELECT MAX(total_hotels) FROM city')
-    result = cursor.fetchone()
-    max_city_hotels = result[0] if result and result[0] else 1
-    
-    # For each destination of the specified type, recalculate the score
-    cursor.execute('SELECT id FROM destination WHERE type = ?', (dest_type,))
-    dest_ids = [row[0] for row in cursor.fetchall()]
-    
-    for dest_id in dest_ids:
-        # Get country
-        cursor.execute('''
-            SELECT d.country_id 
-            FROM destination d 
-            WHERE d.id = ?
-        ''', (dest_id,))
-        result = cursor.fetchone()
-        country_id = result[0] if result else None
-        
-        if not country_id:
-            continue  # Skip if no country_id
-        
-        # Get hotel count from appropriate location table and normalize
-        if dest_type == 'city':
-            cursor.execute('''
-                SELECT ci.total_hotels 
-                FROM destination d 
-                JOIN city ci ON d.city_id = ci.id 
-                WHERE d.id = ?
-            ''', (dest_id,))
-            result = cursor.fetchone()
-            hotel_count = result[0] if result else 0
-            
-            # Get max hotel count within the same country
-            cursor.execute('''
-                SELECT MAX(ci.total_hotels) 
-                FROM city ci 
-                WHERE ci.country_id = ?
-            ''', (country_id,))
-            result = cursor.fetchone()
-            max_country_city_hotels = result[0] if result and result[0] else 1
-        else:  # area
-            cursor.execute('''
-                SELECT ar.total_hotels 
-                FROM destination d 
-                JOIN area ar ON d.area_id = ar.id 
-                WHERE d.id = ?
-            ''', (dest_id,))
-            result = cursor.fetchone()
-            hotel_count = result[0] if result else 0
-            
-            # Get max hotel count within the same country
-            cursor.execute('''
-                SELECT MAX(ci.total_hotels) 
-                FROM city ci 
-                WHERE ci.country_id = ?
-            ''', (country_id,))
-            result = cursor.fetchone()
-            max_country_city_hotels = result[0] if result and result[0] else 1
+    if SHARD_REGIONS:
+        build_search_shards()
+    get_search_cache().invalidate()
+    refresh_prefix_trie()
+    if SUGGESTION_SNAPSHOT:
+        compile_suggestion_snapshot()
+    return True
+
+# SQL used by search_destinations. A single MATCH on search_fts finds every
+# candidate city and area, and the score is either the stored total_score or
+# the score combined from the normalized factors and the weights CTE at query time.
+SEARCH_SQL = '''
+    WITH weights(type, hotel_count_weight, country_hotel_count_weight) AS (
+        {weights}
+    )
+    SELECT DISTINCT
+        si.type,
+        si.name,
+        si.country_name,
+        si.city_name,
+        si.area_name,
+        si.hotel_count,
+        si.hotel_count_normalized,
+        si.country_hotel_count_normalized,
+        {score} as total_score,
+        w.hotel_count_weight,
+        w.country_hotel_count_weight,
+        si.country_total_hotels
+    FROM search_fts
+    JOIN search_index si ON si.id = search_fts.rowid
+    LEFT JOIN weights w ON w.type = si.type
+    WHERE search_fts MATCH :match
+    ORDER BY {order}
+    LIMIT :limit
+'''
+
+# Ordering of search results: search_index rowids follow the ranking for the
+# shared weights, so RANKED_ORDER_SQL lets FTS5 stop after the first 20 matches,
+# while other weights need SORTED_ORDER_SQL over all matches. Ties are broken
+# by the same columns as in REBUILD_SEARCH_INDEX_SQL, so a search over an index
+# left unordered by a refresh returns what a full build would.
+RANKED_ORDER_SQL = 'search_fts.rowid'
+SORTED_ORDER_SQL = '''total_score DESC, si.hotel_count DESC,
+        si.type, si.name, si.country_name, si.city_name, si.area_name,
+        si.hotel_count_normalized, si.country_hotel_count_normalized, si.country_total_hotels'''
+
+# Weights and score used when total_score is read from destination_score
+STORED_WEIGHTS_SQL = 'SELECT type, hotel_count_weight, country_hotel_count_weight FROM factor_weights'
+STORED_SCORE_SQL = 'si.total_score'
+
+# Weights and score used when the score is combined from the factors at query time
+QUERY_TIME_WEIGHTS_SQL = "VALUES ('city', :city_hotel_count_weight, :city_country_hotel_count_weight), ('area', :area_hotel_count_weight, :area_country_hotel_count_weight)"
+QUERY_TIME_SCORE_SQL = f'''(
+        (si.hotel_count_normalized * w.hotel_count_weight + si.country_hotel_count_normalized * w.country_hotel_count_weight)
+        * (CASE WHEN si.destination_country_id = {SCORE_BOOST_COUNTRY_ID} THEN {3 * SCORE_FACTOR_COUNT} ELSE 1 END)
+        / {float(SCORE_FACTOR_COUNT)}
+    )'''
+
+# The search statements are formatted once, so pooled connections keep them prepared
+STORED_SEARCH_SQL = SEARCH_SQL.format(weights=STORED_WEIGHTS_SQL, score=STORED_SCORE_SQL, order=RANKED_ORDER_SQL)
+STORED_SORTED_SEARCH_SQL = SEARCH_SQL.format(weights=STORED_WEIGHTS_SQL, score=STORED_SCORE_SQL, order=SORTED_ORDER_SQL)
+QUERY_TIME_SEARCH_SQL = SEARCH_SQL.format(weights=QUERY_TIME_WEIGHTS_SQL, score=QUERY_TIME_SCORE_SQL, order=RANKED_ORDER_SQL)
+QUERY_TIME_SORTED_SEARCH_SQL = SEARCH_SQL.format(weights=QUERY_TIME_WEIGHTS_SQL, score=QUERY_TIME_SCORE_SQL, order=SORTED_ORDER_SQL)
+
+# Query compiler settings. User input is never passed to FTS5 as query syntax:
+# it is split on whitespace and each chunk is quoted as an FTS5 string, which
+# FTS5 tokenizes itself, so quotes, hyphens, AND/OR/NOT/NEAR and column filters
+# are matched as plain text and every script is tokenized as it was indexed.
+QUERY_MAX_CHARS = 200  # Longer input is cut before it is split
+QUERY_MAX_TERMS = 8  # Terms after these are ignored
+QUERY_MIN_PREFIX_LENGTH = 3  # Single-term queries shorter than this are answered from the popular destinations
+
+# Function to split a query into the terms it is matched with. ASCII terms are
+# lower-cased as the tokenizer folds them; others are kept as typed, since
+# Python's case mapping is not always the tokenizer's.
+def query_terms(query):
+    # Cut before the cached call, so long inputs are not kept whole as cache keys
+    return _query_terms(query[:QUERY_MAX_CHARS])
+
+@functools.lru_cache(maxsize=4096)
+def _query_terms(query):
+    terms = query.split()[:QUERY_MAX_TERMS]
+    return tuple(term.lower() if term.isascii() else term for term in terms)
+
+# Function to check if the terms of a query are runs of ASCII letters and digits,
+# the only text fts_tokens() splits exactly as unicode61 does. Matching in Python
+# (the trie, refinement and fuzzy corrections) is limited to such queries.
+def is_plain_query(query):
+    terms = query_terms(query)
+    return bool(terms) and all(term.isascii() and term.isalnum() for term in terms)
+
+# Function to check if a query is a single prefix too short to search the index with
+def is_short_query(query):
+    terms = query_terms(query)
+    return len(terms) == 1 and len(terms[0]) < QUERY_MIN_PREFIX_LENGTH
+
+# Function to build the MATCH expression of a search query. All terms but the
+# last must match whole and the last one as a prefix. Each column is matched on
+# its own, as the separate per-table FTS searches used to, so the terms of a
+# query never match across a destination's own and parent names.
+def search_match_expression(query):
+    """Return the MATCH expression of a query, or None if it has no terms"""
+    terms = query_terms(query)
+    if not terms:
+        return None
+    return column_match_expression(terms)
+
+# Function to match terms in the name and parent name columns: each term as an
+# FTS5 string, with its quotes doubled, and the last one as a prefix
+def column_match_expression(terms):
+    pattern = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms) + '*'
+    return f"name : ({pattern}) OR parent_name : ({pattern})"
+
+# Optional in-memory autocomplete engine: a prefix trie over the search_fts
+# vocabulary whose nodes store the top 20 results for their prefix, so that
+# single-word queries with the shared weights are answered without SQLite
+AUTOCOMPLETE_TRIE = False
+TRIE_TOP_K = 20
+
+# Function to combine the normalized factors into a score, as QUERY_TIME_SCORE_SQL does
+def combine_score(hotel_count_normalized, country_hotel_count_normalized,
+                  hotel_count_weight, country_hotel_count_weight, country_id):
+    if None in (hotel_count_normalized, country_hotel_count_normalized, hotel_count_weight, country_hotel_count_weight):
+        return None
+    boost_up = 3 * SCORE_FACTOR_COUNT if country_id == SCORE_BOOST_COUNTRY_ID else 1
+    weighted_sum = (hotel_count_normalized * hotel_count_weight) + (country_hotel_count_normalized * country_hotel_count_weight)
+    return weighted_sum * boost_up / float(SCORE_FACTOR_COUNT)
+
+# Function to turn a search_index row into a search result for the weights, as the
+# search SQL does: with combine, the score is combined from the factors at query time
+def rank_result(row, weights, combine):
+    (dest_type, name, country_name, city_name, area_name, hotel_count,
+     hotel_count_normalized, country_hotel_count_normalized, total_score,
+     destination_country_id, country_total_hotels) = row
+    type_weights = weights.get(dest_type, {})
+    hotel_count_weight = type_weights.get('hotel_count_weight')
+    country_hotel_count_weight = type_weights.get('country_hotel_count_weight')
+    if combine:
+        total_score = combine_score(
+            hotel_count_normalized, country_hotel_count_normalized,
+            hotel_count_weight, country_hotel_count_weight, destination_country_id
+        )
+    return (
+        dest_type, name, country_name, city_name, area_name, hotel_count,
+        hotel_count_normalized, country_hotel_count_normalized, total_score,
+        hotel_count_weight, country_hotel_count_weight, country_total_hotels
+    )
+
+# Function to get the ranking key of a search result, matching the row order of
+# REBUILD_SEARCH_INDEX_SQL (NULLs sort last descending and first ascending)
+def result_rank_key(result):
+    (dest_type, name, country_name, city_name, area_name, hotel_count,
+     hotel_count_normalized, country_hotel_count_normalized, total_score,
+     _, _, country_total_hotels) = result
+    return (
+        total_score is None, -(total_score or 0),
+        hotel_count is None, -(hotel_count or 0),
+        dest_type is not None, dest_type or '',
+        name is not None, name or '',
+        country_name is not None, country_name or '',
+        city_name is not None, city_name or '',
+        area_name is not None, area_name or '',
+        hotel_count_normalized is not None, hotel_count_normalized or 0,
+        country_hotel_count_normalized is not None, country_hotel_count_normalized or 0,
+        country_total_hotels is not None, country_total_hotels or 0
+    )
+
+# Array-backed prefix trie over the terms of search_fts. Nodes are numbered in
+# preorder; the children of node n are edge_chars/edge_targets[edge_start[n]:edge_start[n + 1]]
+# sorted by character, and the search_index rows holding a term that ends at n
+# are own_docs[own_start[n]:own_start[n + 1]]. The ranking (result tuples and
+# each node's top results) is kept separately, so a weight change only reranks
+# the existing trie instead of reading the vocabulary again. The arrays and
+# their ranking are published together as one tuple, so a lookup running during
+# a rebuild or rerank sees either the old or the new trie, never a mix.
+class PrefixTrie:
+    def __init__(self):
+        self.built = False
+        self._lock = threading.Lock()
+        self._state = None  # (arrays, ranking)
+    
+    def build(self, conn, weights):
+        """Build the trie from search_index and the search_fts vocabulary"""
+        doc_index = {}
+        doc_rows = []
+        for row in conn.execute('''
+            SELECT id, type, name, country_name, city_name, area_name, hotel_count,
+                hotel_count_normalized, country_hotel_count_normalized, total_score,
+                destination_country_id, country_total_hotels
+            FROM search_index
+        '''):
+            doc_index[row[0]] = len(doc_rows)
+            doc_rows.append(row[1:])
         
-        # Normalize hotel counts - global and country level
-        hotel_count_normalized = int((hotel_count / max_city_hotels) * 100)
-        country_hotel_count_normalized = int((hotel_count / max_country_city_hotels) * 100) if max_country_city_hotels > 200 else 0
+        # Create nodes in preorder from the sorted terms, tracking the path to the previous term
+        node_parent = array('I', [0])
+        node_char = ['']
+        own_docs = []  # (node, doc) pairs
+        path = [0]
+        previous_term = ''
+        for term, doc in conn.execute('SELECT term, doc FROM search_vocab ORDER BY term'):
+            if term != previous_term:
+                common = 0
+                while common < min(len(term), len(previous_term)) and term[common] == previous_term[common]:
+                    common += 1
+                del path[common + 1:]
+                for char in term[common:]:
+                    node_parent.append(path[-1])
+                    node_char.append(char)
+                    path.append(len(node_char) - 1)
+                previous_term = term
+            if doc in doc_index:
+                own_docs.append((path[-1], doc_index[doc]))
+        node_count = len(node_char)
         
-        # Calculate weighted total score with two factors (no rating)
-        weighted_sum = (hotel_count_normalized * hotel_count_weight) + (country_hotel_count_normalized * country_hotel_count_weight)
-        factor_count = 2
+        # Group children by parent; a stable sort keeps them in character order
+        children = sorted(range(1, node_count), key=node_parent.__getitem__)
+        edge_start = array('I', [0]) * (node_count + 1)
+        for child in children:
+            edge_start[node_parent[child] + 1] += 1
+        for node in range(node_count):
+            edge_start[node + 1] += edge_start[node]
+        edge_chars = ''.join(node_char[child] for child in children)
+        edge_targets = array('I', children)
         
-        # Boost score for Thailand
-        boost_up = 3 * factor_count if country_id == 106 else 1
+        own_docs = sorted(set(own_docs))
+        own_start = array('I', [0]) * (node_count + 1)
+        for node, _ in own_docs:
+            own_start[node + 1] += 1
+        for node in range(node_count):
+            own_start[node + 1] += own_start[node]
+        own_docs = array('I', (doc for _, doc in own_docs))
         
-        total_score = weighted_sum * boost_up / factor_count if factor_count > 0 else 0
+        arrays = (doc_rows, edge_start, edge_chars, edge_targets, own_start, own_docs, node_count)
+        self._state = (arrays, self._rank(arrays, weights))
+        self.built = True
+    
+    def rank(self, weights):
+        """Rerank the built trie for the given weights"""
+        arrays = self._state[0]
+        self._state = (arrays, self._rank(arrays, weights))
+    
+    @staticmethod
+    def _rank(arrays, weights):
+        """Compute the result tuples and the top results of every node for the given weights"""
+        doc_rows, edge_start, _, edge_targets, own_start, own_docs, node_count = arrays
+        # Distinct result tuples in ranking order; docs with identical results share an entry
+        doc_results = [rank_result(row, weights, SCORING_MODE == 'query_time') for row in doc_rows]
+        entries = sorted(set(doc_results), key=result_rank_key)
+        entry_index = {result: index for index, result in enumerate(entries)}
+        doc_entries = array('I', (entry_index[result] for result in doc_results))
+        del doc_results, entry_index
         
-        # Update the score
-        cursor.execute('''
-            UPDATE destination_score
-            SET hotel_count_normalized = ?, country_hotel_count_normalized = ?, total_score = ?
-            WHERE destination_id = ?
-        ''', (hotel_count_normalized, country_hotel_count_normalized, total_score, dest_id))
+        # Children are numbered after their parents, so walking the nodes backwards
+        # sees every child's top entries before its parent's
+        top_offset = array('I', [0]) * node_count
+        top_count = array('B', [0]) * node_count
+        top_entries = array('I')
+        for node in range(node_count - 1, -1, -1):
+            candidates = {doc_entries[doc] for doc in own_docs[own_start[node]:own_start[node + 1]]}
+            for child in edge_targets[edge_start[node]:edge_start[node + 1]]:
+                candidates.update(top_entries[top_offset[child]:top_offset[child] + top_count[child]])
+            top = heapq.nsmallest(TRIE_TOP_K, candidates)
+            top_offset[node] = len(top_entries)
+            top_count[node] = len(top)
+            top_entries.extend(top)
+        
+        return entries, top_offset, top_count, top_entries
     
-    conn.commit()
-    conn.close()
-    return True
+    def lookup(self, query):
+        """Return the top results of a single-word query, or None if the trie cannot answer it"""
+        state = self._state
+        terms = query_terms(query)
+        if state is None or len(terms) != 1 or not is_plain_query(query):
+            return None
+        
+        (_, edge_start, edge_chars, edge_targets, _, _, _), ranking = state
+        node = 0
+        for char in terms[0]:
+            start, end = edge_start[node], edge_start[node + 1]
+            index = bisect.bisect_left(edge_chars, char, start, end)
+            if index == end or edge_chars[index] != char:
+                return []
+            node = edge_targets[index]
+        
+        entries, top_offset, top_count, top_entries = ranking
+        return [entries[entry] for entry in top_entries[top_offset[node]:top_offset[node] + top_count[node]]]
+
+# Function to get the process-wide autocomplete trie
+@st.cache_resource(show_spinner=False)
+def get_prefix_trie():
+    return PrefixTrie()
+
+# Function to answer a query from the autocomplete trie, building it on first use
+def trie_search(query):
+    """Return results from the prefix trie, or None when the query needs SQLite"""
+    if not AUTOCOMPLETE_TRIE or FTS_TOKENIZER.split()[0] != 'unicode61':
+        return None
+    trie = get_prefix_trie()
+    if not trie.built:
+        # Concurrent searches fall back to SQLite while one of them builds the trie
+        if not trie._lock.acquire(blocking=False):
+            return None
+        try:
+            if not trie.built:
+                with timed('prefix_trie.build'), read_connection() as conn:
+                    trie.build(conn, get_weights())
+        finally:
+            trie._lock.release()
+    return trie.lookup(query)
+
+# Function to update the autocomplete trie after the shared weights changed
+def refresh_prefix_trie():
+    trie = get_prefix_trie()
+    with trie._lock:
+        if not trie.built:
+            return
+        if SCORING_MODE == 'query_time':
+            # Only the ranking depends on the weights
+            trie.rank(get_weights())
+        else:
+            # Stored scores changed in the database, so read them again
+            trie.built = False
+
+# Function to get the shared factor weights
+def get_weights():
+    """Return the factor weights as {dest_type: {'hotel_count_weight': ..., 'country_hotel_count_weight': ...}}"""
+    return get_weights_cache().get('shared', load_weights)
+
+# Function to read the shared factor weights from the database
+def load_weights():
+    with read_connection() as conn:
+        weights_data = execute_timed(
+            conn, 'get_weights', "SELECT type, hotel_count_weight, country_hotel_count_weight FROM factor_weights"
+        )
+    
+    weights = {}
+    for dest_type, hotel_count_weight, country_hotel_count_weight in weights_data:
+        weights[dest_type] = {
+            'hotel_count_weight': hotel_count_weight,
+            'country_hotel_count_weight': country_hotel_count_weight
+        }
+    return weights
+
+# Function to get the weights the search index rows are ordered by
+def get_ranked_weights():
+    """Return the weights of search_index_layout, or None if the rows are not in ranking order"""
+    return get_weights_cache().get('ranked', load_ranked_weights)
+
+# Function to read the weights of search_index_layout from the database
+def load_ranked_weights():
+    with read_connection() as conn:
+        layout = execute_timed(
+            conn, 'get_ranked_weights',
+            'SELECT scoring_mode, type, hotel_count_weight, country_hotel_count_weight FROM search_index_layout'
+        )
+    if not layout or any(scoring_mode != SCORING_MODE for scoring_mode, _, _, _ in layout):
+        return None
+    return {
+        dest_type: {'hotel_count_weight': hotel_count_weight, 'country_hotel_count_weight': country_hotel_count_weight}
+        for _, dest_type, hotel_count_weight, country_hotel_count_weight in layout
+    }
+
+# Result cache settings for search_destinations
+SEARCH_CACHE_SIZE = 4096  # Maximum number of cached queries
+SEARCH_CACHE_TTL = 300  # Seconds, bounds staleness from writes made by other processes
+
+# LRU cache of search results with a TTL. Keys carry the data version, which
+# update_weights() and data reloads bump, so results computed before a change
+# are never served after it.
+class SearchCache:
+    def __init__(self, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def key(self, query, weights=None):
+        """Return the cache key of a query for the current data version"""
+        # Queries with the same terms match the same rows
+        normalized = ' '.join(query_terms(query))
+        weights_key = None
+        if weights is not None:
+            weights_key = tuple(sorted(
+                (dest_type, w.get('hotel_count_weight'), w.get('country_hotel_count_weight'))
+                for dest_type, w in weights.items()
+            ))
+        return (self.version, normalized, weights_key)
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key, results):
+        with self._lock:
+            if key[0] != self.version:
+                return  # Computed before the data changed
+            self._entries[key] = (time.monotonic(), tuple(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self):
+        """Bump the data version and drop all cached results"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0
+            }
+
+# Function to get the process-wide search result cache
+@st.cache_resource(show_spinner=False)
+def get_search_cache():
+    return SearchCache()
+
+# Process-wide cache of the shared and ranked weights, which every rerun and
+# query-time search reads. Entries belong to a search cache version, so writes
+# that invalidate the search cache also reload the weights, and the TTL bounds
+# staleness from writes made by other processes.
+class WeightsCache:
+    def __init__(self, ttl=SEARCH_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name, load):
+        """Return a copy of the cached weights, calling load() when they are missing or stale"""
+        version = get_search_cache().version
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None or entry[0] != version or time.monotonic() - entry[1] >= self.ttl:
+            # Stamped with the version read before loading, so a concurrent write reloads them
+            entry = (version, time.monotonic(), load())
+            with self._lock:
+                self._entries[name] = entry
+        weights = entry[2]
+        if weights is None:
+            return None
+        return {dest_type: dict(w) for dest_type, w in weights.items()}
+
+# Function to get the process-wide weights cache
+@st.cache_resource(show_spinner=False)
+def get_weights_cache():
+    return WeightsCache()
+
+# Popular destinations of short prefixes. A one-letter prefix matches a large
+# part of the index, and sorting all its matches for session weights or an
+# unordered index takes as long as a hundred other searches, so the top
+# POPULAR_DESTINATIONS_LIMIT matches of each short prefix for the shared weights
+# are kept per data version and ranked in memory instead. Results for the shared
+# weights are exact; other weights rank only those matches.
+POPULAR_DESTINATIONS_LIMIT = 1000
+
+# SQL to read the top search_index rows matching a prefix for the shared weights,
+# in the form rank_result() takes, keyed by the search SQL that ranks them the same way
+POPULAR_SQL = '''
+    WITH weights(type, hotel_count_weight, country_hotel_count_weight) AS (
+        {weights}
+    )
+    SELECT
+        si.type, si.name, si.country_name, si.city_name, si.area_name, si.hotel_count,
+        si.hotel_count_normalized, si.country_hotel_count_normalized, {score} as total_score,
+        si.destination_country_id, si.country_total_hotels
+    FROM search_fts
+    JOIN search_index si ON si.id = search_fts.rowid
+    LEFT JOIN weights w ON w.type = si.type
+    WHERE search_fts MATCH :match
+    ORDER BY {order}
+    LIMIT :limit
+'''
+POPULAR_SQL_BY_SEARCH_SQL = {
+    STORED_SEARCH_SQL: POPULAR_SQL.format(weights=STORED_WEIGHTS_SQL, score=STORED_SCORE_SQL, order=RANKED_ORDER_SQL),
+    STORED_SORTED_SEARCH_SQL: POPULAR_SQL.format(weights=STORED_WEIGHTS_SQL, score=STORED_SCORE_SQL, order=SORTED_ORDER_SQL),
+    QUERY_TIME_SEARCH_SQL: POPULAR_SQL.format(weights=QUERY_TIME_WEIGHTS_SQL, score=QUERY_TIME_SCORE_SQL, order=RANKED_ORDER_SQL),
+    QUERY_TIME_SORTED_SEARCH_SQL: POPULAR_SQL.format(weights=QUERY_TIME_WEIGHTS_SQL, score=QUERY_TIME_SCORE_SQL, order=SORTED_ORDER_SQL)
+}
+
+class PopularDestinations:
+    def __init__(self, limit=POPULAR_DESTINATIONS_LIMIT):
+        self.limit = limit
+        self._entries = {}  # prefix -> (search cache version, rows in ranking order)
+        self._lock = threading.Lock()
+    
+    def rows(self, prefix):
+        """Return the top matching rows of a prefix for the shared weights, reading them once per data version"""
+        version = get_search_cache().version
+        with self._lock:
+            entry = self._entries.get(prefix)
+        if entry is None or entry[0] != version:
+            sql, _, params = search_sql()
+            params.update(match=search_match_expression(prefix), limit=self.limit)
+            with read_connection() as conn:
+                rows = execute_timed(conn, 'popular_destinations', POPULAR_SQL_BY_SEARCH_SQL[sql], params)
+            entry = (version, rows)
+            with self._lock:
+                self._entries[prefix] = entry
+        return entry[1]
+    
+    def search(self, query, weights=None, limit=20):
+        """Return the top results of a short query, as search_destinations would rank them"""
+        combine = SCORING_MODE == 'query_time' or weights is not None
+        if weights is None:
+            weights = get_weights()
+        results = {rank_result(row, weights, combine) for row in self.rows(query_terms(query)[0])}
+        return heapq.nsmallest(limit, results, key=result_rank_key)
+
+# Function to get the process-wide popular destinations
+@st.cache_resource(show_spinner=False)
+def get_popular_destinations():
+    return PopularDestinations()
 
 # Function to search destinations
-def search_destinations(query):
-    conn = get_connection()
-    cursor = conn.cursor()
-    match_pattern = f"{query}*"
+def search_destinations(query, weights=None):
+    """Search destinations and return the top 20 by score, using the result cache.
+
+    In 'query_time' scoring mode, or when weights are passed (the same shape as
+    get_weights() returns, e.g. a session's what-if weights), the score is
+    combined from the stored normalized factors at query time, so weight
+    changes never need to touch destination_score.
+    """
+    start = time.perf_counter()
+    results = trie_search(query) if weights is None else None
+    if results is not None and (len(results) >= FUZZY_MIN_RESULTS or not FUZZY_SEARCH):
+        source = 'trie'
+    else:
+        cache = get_search_cache()
+        key = cache.key(query, weights)
+        results = cache.get(key)
+        source = 'cache'
+        if results is None and is_short_query(query):
+            results = get_popular_destinations().search(query, weights)
+            source = 'popular'
+            cache.put(key, results)
+        elif results is None:
+            results = query_destinations(query, weights)
+            source = 'database'
+            # Not cached while the fuzzy index is being built or a fuzzy search ran out of time
+            fuzzy_results = add_fuzzy_results(query, weights, results)
+            if fuzzy_results is not None:
+                results = fuzzy_results
+                cache.put(key, results)
+    get_query_metrics().record(f'search_destinations.{source}', time.perf_counter() - start, len(results))
+    return results
+
+# Function to search many queries concurrently
+def search_many(queries, weights=None, workers=READ_POOL_SIZE, ordered=True):
+    """Search a batch of queries over a thread pool, e.g. for audits or precomputing suggestions.
+
+    Returns a list of results in input order, or, when ordered is False, an
+    iterator of (index, results) pairs in the order the searches finish.
+    Workers are capped at the read pool size, so each worker keeps using one
+    read-only connection; SQLite releases the GIL while it runs a query.
+    """
+    queries = list(queries)
+    workers = max(1, min(workers, READ_POOL_SIZE, len(queries) or 1))
+    if ordered:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda query: search_destinations(query, weights), queries))
+    return _search_as_completed(queries, weights, workers)
+
+def _search_as_completed(queries, weights, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(search_destinations, query, weights): index for index, query in enumerate(queries)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+# Incremental refinement settings. A query that extends an earlier query of the
+# same session matches a subset of its rows, so when the earlier query's full
+# candidate set is known the new results are filtered from it in memory.
+REFINE_CANDIDATE_LIMIT = 1000  # Queries with more matches are not refined and run as usual
+REFINE_ENTRIES = 16  # Candidate sets kept per session
+
+FTS_TOKEN_RE = re.compile(r'[^\W_]+')
+
+# SQL to count the matches of a query, up to :limit
+REFINE_COUNT_SQL = 'SELECT COUNT(*) FROM (SELECT 1 FROM search_fts WHERE search_fts MATCH :match LIMIT :limit)'
+
+# Function to split a text into the terms the unicode61 tokenizer indexes, in order:
+# case-folded runs of letters and digits without diacritics. Only ASCII text is
+# split exactly; other text is approximated (all combining marks are dropped,
+# while unicode61 keeps some diacritics and splits words at others)
+def fts_tokens(text):
+    text = text or ''
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFD', text) if not unicodedata.combining(ch))
+    return FTS_TOKEN_RE.findall(text.lower())
+
+# Function to get the set of terms of a name
+@functools.lru_cache(maxsize=65536)
+def fts_terms(text):
+    return frozenset(fts_tokens(text))
+
+# Function to get the terms of the name and parent name columns of a search result,
+# or None if either is not ASCII and fts_tokens() cannot be trusted to split it.
+# A city's parent name is its country, an area's is its city.
+def result_terms(result):
+    name, parent_name = result[1] or '', (result[2] if result[0] == 'city' else result[3]) or ''
+    if not (name.isascii() and parent_name.isascii()):
+        return None
+    return fts_terms(name), fts_terms(parent_name)
+
+# Function to check a search result against a plain query, as search_match_expression
+# matches it: all but the last word as terms and the last word as a prefix, in one column
+def result_matches(terms, words):
+    *whole_words, prefix = words
+    for column_terms in terms:
+        if all(word in column_terms for word in whole_words) and any(term.startswith(prefix) for term in column_terms):
+            return True
+    return False
+
+# Per-session cache of full candidate sets for as-you-type narrowing. Searches
+# that cannot use the ranked row order (what-if weights, or an index left
+# unordered by a refresh) sort every match in SQLite; when such a query extends
+# a cached query with at most REFINE_CANDIDATE_LIMIT matches, its results are
+# filtered from that query's candidates instead. Queries with more matches run
+# as usual. The Streamlit app keeps one in st.session_state, other callers can
+# keep one per user or connection.
+class RefinementCache:
+    def __init__(self, maxsize=REFINE_ENTRIES, candidate_limit=REFINE_CANDIDATE_LIMIT):
+        self.maxsize = maxsize
+        self.candidate_limit = candidate_limit
+        self.refined = 0
+        self.fetched = 0
+        self._entries = OrderedDict()  # cache key -> candidates in ranking order
     
-    # Enhanced search with multiple FTS strategies:
-    # 1. Direct city name match (FTS search)
-    # 2. Direct area name match (FTS search)
-    # 3. Cities by country name match (FTS search on country names)
-    # 4. Areas by city name match (FTS search on city names)
-    cursor.execute('''
-        -- direct_city
-        SELECT DISTINCT
-            'city' as type,
-            ci.name, 
-            co.name as country_name,
-            ci.name as city_name,
-            NULL as area_name,
-            ci.total_hotels as hotel_count,
-            s.hotel_count_normalized,
-            s.country_hotel_count_normalized,
-            s.total_score,
-            w.hotel_count_weight,
-            w.country_hotel_count_weight,
-            co.total_hotels as country_total_hotels
-        FROM city ci
-        JOIN city_fts fts ON ci.id = fts.rowid
-        LEFT JOIN country co ON ci.country_id = co.id
-        LEFT JOIN destination d ON d.city_id = ci.id AND d.type = 'city'
-        LEFT JOIN destination_score s ON d.id = s.destination_id
-        LEFT JOIN factor_weights w ON w.type = 'city'
-        WHERE fts.name MATCH ?
+    def find(self, key):
+        """Return the complete candidate set of the longest cached query that key's query extends"""
+        version, normalized, weights_key = key
+        best = None
+        for (entry_version, entry_query, entry_weights_key), entry in list(self._entries.items()):
+            if entry_version != version:
+                del self._entries[(entry_version, entry_query, entry_weights_key)]
+                continue
+            if (entry_weights_key == weights_key and normalized.startswith(entry_query)
+                    and (best is None or len(entry_query) > len(best[0]))):
+                best = entry_query, entry
+        return best[1] if best else None
+    
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def search(self, query, weights=None):
+        """Return the same top 20 results as search_destinations(query, weights)"""
+        if FTS_TOKENIZER != 'unicode61' or not is_plain_query(query) or is_short_query(query):
+            return search_destinations(query, weights)
+        results = trie_search(query) if weights is None else None
+        if results is not None and (len(results) >= FUZZY_MIN_RESULTS or not FUZZY_SEARCH):
+            return results
+        # Ranked searches stop after 20 matches, which is cheaper than fetching candidates
+        if search_sql(weights)[0] in (QUERY_TIME_SEARCH_SQL, STORED_SEARCH_SQL):
+            return search_destinations(query, weights)
         
-        UNION
+        start = time.perf_counter()
+        cache = get_search_cache()
+        key = cache.key(query, weights)
+        results = cache.get(key)
+        if results is not None:
+            get_query_metrics().record('search_destinations.cache', time.perf_counter() - start, len(results))
+            return results
+        parent = self.find(key)
+        parent_terms = None
+        if parent is not None:
+            parent_terms = [result_terms(result) for result in parent]
+            # Candidates with names that are not ASCII are only matched reliably by SQLite
+            if None in parent_terms:
+                parent_terms = None
+        if parent_terms is not None:
+            # Results keep their ranking order, so the first 20 matches are the top 20
+            words = key[1].split(' ')
+            candidates = [result for result, terms in zip(parent, parent_terms) if result_matches(terms, words)]
+            self.put(key, candidates)
+            self.refined += 1
+            source = 'refined'
+        else:
+            # Counting the matches on search_fts alone is cheap next to fetching them
+            with read_connection() as conn:
+                count = execute_timed(conn, 'refinement.count', REFINE_COUNT_SQL, {
+                    'match': search_match_expression(query), 'limit': self.candidate_limit + 1
+                })[0][0]
+            if count > self.candidate_limit:
+                return search_destinations(query, weights)
+            candidates = query_destinations(query, weights, self.candidate_limit)
+            # Order ties the way the ranked search index does, whichever SQL ran
+            candidates.sort(key=result_rank_key)
+            self.put(key, candidates)
+            self.fetched += 1
+            source = 'candidates'
+        results = candidates[:20]
+        fuzzy_results = add_fuzzy_results(query, weights, results)
+        if fuzzy_results is not None:
+            results = fuzzy_results
+            cache.put(key, results)
+        get_query_metrics().record(f'search_destinations.{source}', time.perf_counter() - start, len(results))
+        return results
+    
+    def stats(self):
+        return {'size': len(self._entries), 'refined': self.refined, 'fetched': self.fetched}
+
+# Function to run a search against the database, bypassing the result cache
+def query_destinations(query, weights=None, limit=20):
+    # One FTS search covers all strategies, since search_index rows carry both names:
+    # 1. Direct city name match and direct area name match (name column)
+    # 2. Cities by country name match and areas by city name match (parent_name column)
+    match = search_match_expression(query)
+    if match is None:
+        return []
+    sql, operation, params = search_sql(weights)
+    params.update(match=match, limit=limit)
+    
+    # Ranked searches stop after the first matches, so only sorted searches are split across shards
+    if SHARD_REGIONS and sql not in (QUERY_TIME_SEARCH_SQL, STORED_SEARCH_SQL):
+        results = query_shards(sql, operation, params)
+        if results is not None:
+            return results
+    with read_connection() as conn:
+        return execute_timed(conn, operation, sql, params)
+
+# Function to choose the search SQL for the weights
+def search_sql(weights=None):
+    """Return the SQL, operation name and weight parameters of a search"""
+    params = {}
+    
+    # The row order of search_index only ranks results for the weights it was
+    # built with, and not at all after an incremental refresh
+    ranked_weights = get_ranked_weights()
+    if SCORING_MODE == 'query_time' or weights is not None:
+        if weights is None:
+            weights = get_weights()
         
-        -- direct_area
-        SELECT DISTINCT
-            'area' as type,
-            ar.name, 
-            co.name as country_name,
-            ci.name as city_name,
-            ar.name as area_name,
-            ar.total_hotels as hotel_count,
-            s.hotel_count_normalized,
-            s.country_hotel_count_normalized,
-            s.total_score,
-            w.hotel_count_weight,
-            w.country_hotel_count_weight,
-            co.total_hotels as country_total_hotels
-        FROM area ar
-        JOIN area_fts fts ON ar.id = fts.rowid
-        LEFT JOIN city ci ON ar.city_id = ci.id
-        LEFT JOIN country co ON ci.country_id = co.id
-        LEFT JOIN destination d ON d.area_id = ar.id AND d.type = 'area'
-        LEFT JOIN destination_score s ON d.id = s.destination_id
-        LEFT JOIN factor_weights w ON w.type = 'area'
-        WHERE fts.name MATCH ?
+        ranked = ranked_weights is not None
+        for dest_type in ['city', 'area']:
+            type_weights = weights.get(dest_type, {})
+            ranked_type_weights = (ranked_weights or {}).get(dest_type, {})
+            for weight_name in ['hotel_count_weight', 'country_hotel_count_weight']:
+                params[f'{dest_type}_{weight_name}'] = type_weights.get(weight_name)
+                if type_weights.get(weight_name) != ranked_type_weights.get(weight_name):
+                    ranked = False
+        sql = QUERY_TIME_SEARCH_SQL if ranked else QUERY_TIME_SORTED_SEARCH_SQL
+        operation = 'query_destinations.ranked' if ranked else 'query_destinations.sorted'
+    elif ranked_weights is not None:
+        sql = STORED_SEARCH_SQL
+        operation = 'query_destinations.stored'
+    else:
+        sql = STORED_SORTED_SEARCH_SQL
+        operation = 'query_destinations.stored_sorted'
+    return sql, operation, params
+
+# Typo-tolerant search. When a query finds fewer than FUZZY_MIN_RESULTS
+# destinations, its words are corrected with a symmetric-delete index over the
+# search_fts vocabulary: every term and term prefix is stored under itself and
+# each string one deletion away, so the strings within one edit of a query
+# word (a substitution, insertion, deletion or swap of adjacent letters) are
+# found with a handful of lookups instead of a scan.
+FUZZY_SEARCH = True
+FUZZY_MIN_RESULTS = 20  # Exact results below this are followed by fuzzy ones
+FUZZY_MIN_LENGTH = 3  # Shorter words are never corrected
+FUZZY_MAX_LENGTH = 10  # Longest indexed prefix; longer last words are corrected on their first letters
+FUZZY_MAX_CORRECTIONS = 8  # Corrections tried per word, most frequent first
+FUZZY_MAX_EXPRESSIONS = 16  # Corrected queries combined into one MATCH
+FUZZY_TIME_BUDGET = 0.05  # Seconds; a fuzzy search running longer is interrupted
+
+# Function to check if two strings are at most one edit apart,
+# counting a swap of adjacent characters as one edit
+def within_one_edit(a, b):
+    if abs(len(a) - len(b)) > 1:
+        return False
+    common = 0
+    while common < min(len(a), len(b)) and a[common] == b[common]:
+        common += 1
+    if len(a) == len(b):
+        return (a[common + 1:] == b[common + 1:]
+                or (a[common + 2:] == b[common + 2:] and a[common:common + 2] == b[common:common + 2][::-1]))
+    if len(a) > len(b):
+        return a[common + 1:] == b[common:]
+    return a[common:] == b[common + 1:]
+
+# Symmetric-delete index of the search_fts vocabulary. Keys are the terms and
+# their prefixes of FUZZY_MIN_LENGTH to FUZZY_MAX_LENGTH characters. Each key
+# and each of its one-deletion variants is stored as one integer, a 40-bit
+# hash of the variant above the 24-bit id of the key, in a sorted array.
+# Lookups verify their candidates, so hash collisions only cost a comparison.
+# The keys, terms and entries are published together as one tuple, so a search
+# running during a rebuild uses either the old or the new index, never a mix.
+FUZZY_HASH_BITS = 40
+FUZZY_KEY_BITS = 24
+
+class FuzzyIndex:
+    def __init__(self):
+        self.built = False
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._state = None  # (keys, key_set, terms, entries)
+    
+    def invalidate(self):
+        """Mark the index as stale after the data changed"""
+        self.generation += 1
+        self.built = False
+    
+    def build(self, conn):
+        generation = self.generation
+        frequency = {}
+        terms = set()
+        for term, docs in conn.execute('SELECT term, COUNT(*) FROM search_vocab GROUP BY term'):
+            if len(term) >= FUZZY_MIN_LENGTH:
+                terms.add(term)
+                frequency[term] = frequency.get(term, 0) + docs
+            for length in range(FUZZY_MIN_LENGTH, min(len(term) - 1, FUZZY_MAX_LENGTH) + 1):
+                prefix = term[:length]
+                frequency[prefix] = frequency.get(prefix, 0) + docs
         
-        UNION
+        keys = sorted(frequency, key=lambda key: (-frequency[key], key))[:1 << FUZZY_KEY_BITS]
+        entries = []
+        for key_id, key in enumerate(keys):
+            entries.append(self._hash(key) | key_id)
+            entries.extend([self._hash(key[:position] + key[position + 1:]) | key_id for position in range(len(key))])
+        entries.sort()
         
-        -- city_by_country_fts
-        SELECT DISTINCT
-            'city' as type,
-            ci.name, 
-            co.name as country_name,
-            ci.name as city_name,
-            NULL as area_name,
-            ci.total_hotels as hotel_count,
-            s.hotel_count_normalized,
-            s.country_hotel_count_normalized,
-            s.total_score,
-            w.hotel_count_weight,
-            w.country_hotel_count_weight,
-            co.total_hotels as country_total_hotels
-        FROM city ci
-        LEFT JOIN country co ON ci.country_id = co.id
-        JOIN country_fts country_fts ON co.id = country_fts.rowid
-        LEFT JOIN destination d ON d.city_id = ci.id AND d.type = 'city'
-        LEFT JOIN destination_score s ON d.id = s.destination_id
-        LEFT JOIN factor_weights w ON w.type = 'city'
-        WHERE country_fts.name MATCH ?
+        # Keys are most frequent first, so key ids order corrections by frequency
+        self._state = (keys, frozenset(keys), frozenset(terms), array('Q', entries))
+        self.built = generation == self.generation
+    
+    @staticmethod
+    def _hash(text):
+        """Return the hash of a variant, shifted above the key id bits"""
+        return (hash(text) & ((1 << FUZZY_HASH_BITS) - 1)) << FUZZY_KEY_BITS
+    
+    def corrections(self, word, prefix, state=None):
+        """Return up to FUZZY_MAX_CORRECTIONS indexed strings one edit from word, most frequent first.
+
+        A prefix word is corrected to term prefixes, any other word to whole terms.
+        state is an index tuple read earlier, so that all words of a query use the same index.
+        """
+        keys, _, terms, entries = state or self._state
+        if len(word) < FUZZY_MIN_LENGTH:
+            return []
+        if prefix:
+            word = word[:FUZZY_MAX_LENGTH]
+        key_ids = set()
+        key_mask = (1 << FUZZY_KEY_BITS) - 1
+        for variant in {word} | {word[:position] + word[position + 1:] for position in range(len(word))}:
+            variant_hash = self._hash(variant)
+            index = bisect.bisect_left(entries, variant_hash)
+            while index < len(entries) and entries[index] & ~key_mask == variant_hash:
+                key_ids.add(entries[index] & key_mask)
+                index += 1
         
-        UNION
+        corrections = []
+        for key_id in sorted(key_ids):
+            key = keys[key_id]
+            if key != word and (prefix or key in terms) and within_one_edit(word, key):
+                corrections.append(key)
+                if len(corrections) == FUZZY_MAX_CORRECTIONS:
+                    break
+        return corrections
+    
+    def expressions(self, words):
+        """Return corrected versions of a query's words, with one word corrected or two adjacent words joined"""
+        state = self._state
+        _, key_set, terms, _ = state
+        variants = []
+        last = len(words) - 1
+        for position in range(last):
+            joined = words[position] + words[position + 1]
+            if (position + 1 == last and joined[:FUZZY_MAX_LENGTH] in key_set) or joined in terms:
+                variants.append(words[:position] + [joined] + words[position + 2:])
+        for position, word in enumerate(words):
+            for correction in self.corrections(word, position == last, state):
+                variants.append(words[:position] + [correction] + words[position + 1:])
+        return variants[:FUZZY_MAX_EXPRESSIONS]
+
+# Function to get the process-wide fuzzy index
+@st.cache_resource(show_spinner=False)
+def get_fuzzy_index():
+    return FuzzyIndex()
+
+# Function to get the fuzzy index, building it on a background thread on first use
+def ready_fuzzy_index():
+    """Return the fuzzy index, or None while it is being built"""
+    index = get_fuzzy_index()
+    if index.built:
+        return index
+    if index._lock.acquire(blocking=False):
+        def build():
+            try:
+                with timed('fuzzy_index.build'), read_connection() as conn:
+                    index.build(conn)
+            except sqlite3.Error as e:
+                print(f"Error building the fuzzy index: {e}")
+            finally:
+                index._lock.release()
+        threading.Thread(target=build, name='fuzzy-index', daemon=True).start()
+    return None
+
+# Function to build the MATCH expression of corrected queries, matching each the way
+# search_match_expression does: earlier words as terms and the last word as a prefix
+def fuzzy_match_expression(variants):
+    return ' OR '.join(column_match_expression(words) for words in variants)
+
+# Function to follow the exact results of a query with the results of its corrections
+def add_fuzzy_results(query, weights, results):
+    """Return results followed by fuzzy matches, up to FUZZY_MIN_RESULTS in all.
+
+    Returns None while the fuzzy index is being built or when the search runs
+    out of FUZZY_TIME_BUDGET; callers then use the exact results uncached.
+    """
+    if not FUZZY_SEARCH or len(results) >= FUZZY_MIN_RESULTS:
+        return results
+    # Corrections come from the index vocabulary, which only plain terms are compared with
+    if not is_plain_query(query):
+        return results
+    words = list(query_terms(query))
+    index = ready_fuzzy_index()
+    if index is None:
+        return None
+    
+    start = time.perf_counter()
+    variants = index.expressions(words)
+    if not variants:
+        return results
+    sql, _, params = search_sql(weights)
+    params.update(match=fuzzy_match_expression(variants), limit=FUZZY_MIN_RESULTS + len(results))
+    try:
+        with read_connection() as conn:
+            rows = execute_timed(conn, 'fuzzy_search', sql, params, deadline=start + FUZZY_TIME_BUDGET)
+    except sqlite3.OperationalError as e:
+        if 'interrupted' not in str(e):
+            raise
+        get_query_metrics().record('fuzzy_search.timeout', time.perf_counter() - start)
+        return None
+    
+    exact = set(results)
+    fuzzy = [row for row in rows if row not in exact]
+    return list(results) + fuzzy[:FUZZY_MIN_RESULTS - len(results)]
+
+# Optional region-sharded search. With regions configured, the search tables
+# (search_index, search_fts and the weights they are ranked with) are split by
+# country into one SQLite file per region next to destinations.db, which keeps
+# the base tables, scores and weights. Scores are computed there before the
+# split, so every shard uses the same global normalization. Searches that sort
+# all their matches run on all shards in parallel, and their top results are
+# merged; ranked searches stop after the first matches and stay on destinations.db.
+SHARD_REGIONS = {}  # Region name -> country ids, e.g. {'asia': [106, 107]}; empty keeps a single database
+SHARD_DEFAULT_REGION = 'other'  # Region of unlisted countries and of cities without a country
+SHARD_WORKERS = READ_POOL_SIZE  # Threads running shard searches, shared by all sessions
+SHARD_TABLES = ('search_index', 'search_index_layout', 'factor_weights')
+
+# Function to get the SQL condition on search_index.country_id of every region shard
+def shard_regions():
+    """Return {region: condition}; a country listed in several regions belongs to the first"""
+    assigned = {}
+    for region, country_ids in SHARD_REGIONS.items():
+        for country_id in country_ids:
+            assigned.setdefault(int(country_id), region)
+    regions = {}
+    for region in SHARD_REGIONS:
+        country_ids = ', '.join(str(country_id) for country_id, owner in assigned.items() if owner == region)
+        regions[region] = f'country_id IN ({country_ids})'
+    rest = f"country_id IS NULL OR country_id NOT IN ({', '.join(str(country_id) for country_id in assigned)})"
+    if SHARD_DEFAULT_REGION in regions:
+        regions[SHARD_DEFAULT_REGION] = f'{regions[SHARD_DEFAULT_REGION]} OR {rest}'
+    else:
+        regions[SHARD_DEFAULT_REGION] = rest
+    return regions
+
+# Function to get the database file of a region shard
+def shard_path(region):
+    root, extension = os.path.splitext(get_connection_pool().path)
+    return f'{root}.{region}{extension}'
+
+# Function to get the prefix of the shard tokens built for the configured regions
+def shard_config_hash():
+    return hashlib.sha256(json.dumps(shard_regions(), sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+# Function to build the search shard of one region from destinations.db
+def build_search_shard(region, condition, schema, token):
+    """Copy the region's search_index rows in ranking order into a new shard file and return their number"""
+    path = shard_path(region)
+    build_path = f'{path}.build'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(build_path + suffix):
+            os.remove(build_path + suffix)
+    
+    conn = sqlite3.connect(build_path)
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+        cursor = conn.cursor()
+        cursor.execute('ATTACH DATABASE ? AS source', (get_connection_pool().path,))
+        for sql in schema:
+            cursor.execute(sql)
+        cursor.execute(fts_table_sql('search_fts', *FTS_TABLES['search_fts']))
         
-        -- area_by_city_fts
-        SELECT DISTINCT
-            'area' as type,
-            ar.name, 
-            co.name as country_name,
-            ci.name as city_name,
-            ar.name as area_name,
-            ar.total_hotels as hotel_count,
-            s.hotel_count_normalized,
-            s.country_hotel_count_normalized,
-            s.total_score,
-            w.hotel_count_weight,
-            w.country_hotel_count_weight,
-            co.total_hotels as country_total_hotels
-        FROM area ar
-        LEFT JOIN city ci ON ar.city_id = ci.id
-        JOIN city_fts city_fts ON ci.id = city_fts.rowid
-        LEFT JOIN country co ON ci.country_id = co.id
-        LEFT JOIN destination d ON d.area_id = ar.id AND d.type = 'area'
-        LEFT JOIN destination_score s ON d.id = s.destination_id
-        LEFT JOIN factor_weights w ON w.type = 'area'
-        WHERE city_fts.name MATCH ?
+        # Rows keep their ids, so FTS5 still returns a shard's matches in ranking order
+        cursor.execute(f'INSERT INTO search_index SELECT * FROM source.search_index WHERE {condition} ORDER BY id')
+        rows = cursor.rowcount
+        cursor.execute("INSERT INTO search_fts(search_fts) VALUES('rebuild')")
+        cursor.execute("INSERT INTO search_fts(search_fts) VALUES('optimize')")
+        cursor.execute('INSERT INTO search_index_layout SELECT * FROM source.search_index_layout')
+        cursor.execute('INSERT INTO factor_weights SELECT * FROM source.factor_weights')
         
-        ORDER BY total_score DESC, hotel_count DESC
-        LIMIT 20
-    ''', (match_pattern, match_pattern, match_pattern, match_pattern))
+        cursor.execute('CREATE TABLE build_info (key TEXT PRIMARY KEY, value TEXT)')
+        cursor.executemany('INSERT INTO build_info (key, value) VALUES (?, ?)', [
+            ('shard_region', region),
+            ('shard_token', token),
+            ('built_at', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        ])
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+        cursor.execute('DETACH DATABASE source')
+        cursor.execute('PRAGMA optimize')
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        cursor.close()
+    finally:
+        conn.close()
     
-    # Remove the match_type column from results before returning
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    get_connection_pool(path).swap(build_path)
+    return rows
+
+# Function to split the search tables of destinations.db into the region shards
+def build_search_shards():
+    """Rebuild every region shard from destinations.db and return the rows of each.
+
+    Must be called whenever search_index or the shared weights change; the
+    write functions do so when SHARD_REGIONS is set. Shards are built one at a
+    time and swapped in, so searches keep running on the others.
+    """
+    token = f'{shard_config_hash()}:{os.urandom(8).hex()}'
+    rows = {}
+    with timed('build_search_shards'), get_connection_pool().exclusive():
+        with read_connection() as conn:
+            schema = [sql for (sql,) in conn.execute(
+                f"SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' * len(SHARD_TABLES))})",
+                SHARD_TABLES
+            )]
+        for region, condition in shard_regions().items():
+            rows[region] = build_search_shard(region, condition, schema, token)
+        with write_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO build_info (key, value) VALUES ('shard_token', ?)", (token,))
+    return rows
+
+# Function to check that every region shard was built from the current destinations.db
+def search_shards_are_current():
+    with read_connection() as conn:
+        row = conn.execute("SELECT value FROM build_info WHERE key = 'shard_token'").fetchone()
+    if row is None or not row[0].startswith(f'{shard_config_hash()}:'):
+        return False
+    for region in shard_regions():
+        path = shard_path(region)
+        if not os.path.exists(path):
+            return False
+        try:
+            with get_connection_pool(path).reader() as conn:
+                shard_row = conn.execute("SELECT value FROM build_info WHERE key = 'shard_token'").fetchone()
+        except sqlite3.Error:
+            return False
+        if shard_row != row:
+            return False
+    return True
+
+# Function to get the process-wide executor of shard searches
+@st.cache_resource(show_spinner=False)
+def get_shard_executor():
+    return ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix='shard')
+
+# Function to run a search on every region shard in parallel and merge their results
+def query_shards(sql, operation, params):
+    """Return the top :limit results of all shards, or None if a shard cannot be searched"""
+    def query_shard(region):
+        with get_connection_pool(shard_path(region)).reader() as conn:
+            return execute_timed(conn, f'{operation}.shard', sql, params)
+    
+    try:
+        shard_results = list(get_shard_executor().map(query_shard, shard_regions()))
+    except sqlite3.Error as e:
+        print(f"Error searching the region shards, searching {DB_PATH} instead: {e}")
+        return None
+    # Each shard returns its own top results, so the overall top results are among them.
+    # result_rank_key orders them as the search index of a single database does.
+    return heapq.nsmallest(params['limit'], itertools.chain.from_iterable(shard_results), key=result_rank_key)
+
+# Static suggestion snapshot: the results of every short prefix that occurs in
+# the indexed names, compiled into one file that clients memory-map and search
+# without SQLite. The file is
+#   magic, header length, record count           (SUGGESTION_FILE_HEADER)
+#   header                                       (JSON: token, prefix length, build time)
+#   record offsets                               (count x uint64, in key order)
+#   records                                      (uint16 key length, key, uint32 results length, results JSON)
+# with keys sorted by their UTF-8 bytes, so a lookup is a binary search over the offsets.
+SUGGESTION_SNAPSHOT = False  # Recompile the snapshot whenever the data or the shared weights change
+SUGGESTION_SNAPSHOT_PATH = 'suggestions.bin'
+SUGGESTION_PREFIX_LENGTH = 4  # Longest prefix compiled, in characters
+SUGGESTION_FILE_MAGIC = b'DSUGGEST'
+SUGGESTION_FILE_VERSION = 1
+SUGGESTION_FILE_HEADER = struct.Struct('<8sII')
+SUGGESTION_OFFSET = struct.Struct('<Q')
+SUGGESTION_KEY_LENGTH = struct.Struct('<H')
+SUGGESTION_RESULTS_LENGTH = struct.Struct('<I')
+
+# Function to normalize a query to the key of its snapshot record: its unicode61
+# terms joined by single spaces, which match the same rows as the query
+def suggestion_key(query):
+    return ' '.join(query_terms(query))
+
+# Function to get the prefixes compiled into the suggestion snapshot
+def suggestion_prefixes(conn, prefix_length=SUGGESTION_PREFIX_LENGTH):
+    """Return the keys of up to prefix_length characters that start a word of a name or parent name"""
+    prefixes = set()
+    for (name,) in conn.execute('SELECT name FROM search_index UNION SELECT parent_name FROM search_index'):
+        words = fts_tokens(name)
+        for start in range(len(words)):
+            # Queries such as 'new y' continue past the first word
+            text = ' '.join(words[start:])[:prefix_length].rstrip()
+            prefixes.update(text[:length].rstrip() for length in range(1, len(text) + 1))
+    prefixes.discard('')
+    return sorted(prefixes, key=lambda prefix: prefix.encode('utf-8'))
+
+# Function to compile the suggestion snapshot from the current data and shared weights
+def compile_suggestion_snapshot(path=SUGGESTION_SNAPSHOT_PATH, prefix_length=SUGGESTION_PREFIX_LENGTH):
+    """Write the top 20 results of every prefix to path and return the number of prefixes.
+    
+    Results are those search_destinations returns for the shared weights,
+    including fuzzy matches. The snapshot is written to a scratch file and
+    renamed over path, so clients that have it mapped keep reading the old one.
+    """
+    token = f'{prefix_length}:{os.urandom(8).hex()}'
+    build_path = f'{path}.build'
+    with timed('compile_suggestion_snapshot'), get_connection_pool().exclusive():
+        # Build the fuzzy index up front, so no prefix is compiled without its fuzzy matches
+        index = get_fuzzy_index()
+        with index._lock:
+            if FUZZY_SEARCH and not index.built:
+                with read_connection() as conn:
+                    index.build(conn)
+        with read_connection() as conn:
+            prefixes = suggestion_prefixes(conn, prefix_length)
+        
+        header = json.dumps({
+            'version': SUGGESTION_FILE_VERSION,
+            'token': token,
+            'prefix_length': prefix_length,
+            'scoring_mode': SCORING_MODE,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }).encode('utf-8')
+        records_start = SUGGESTION_FILE_HEADER.size + len(header) + SUGGESTION_OFFSET.size * len(prefixes)
+        with open(build_path, 'wb') as f:
+            f.write(SUGGESTION_FILE_HEADER.pack(SUGGESTION_FILE_MAGIC, len(header), len(prefixes)))
+            f.write(header)
+            f.seek(records_start)
+            offsets = array('Q')
+            for prefix in prefixes:
+                results = query_destinations(prefix)
+                # A fuzzy search that runs out of time leaves the exact results
+                results = add_fuzzy_results(prefix, None, results) or results
+                key = prefix.encode('utf-8')
+                payload = json.dumps(results, separators=(',', ':')).encode('utf-8')
+                offsets.append(f.tell())
+                f.write(SUGGESTION_KEY_LENGTH.pack(len(key)) + key)
+                f.write(SUGGESTION_RESULTS_LENGTH.pack(len(payload)) + payload)
+            f.seek(SUGGESTION_FILE_HEADER.size + len(header))
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            f.write(offsets.tobytes())
+        os.replace(build_path, path)
+        with write_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO build_info (key, value) VALUES ('suggestion_token', ?)", (token,))
+    return len(prefixes)
+
+# Function to check that the suggestion snapshot was compiled from the current data and weights
+def suggestion_snapshot_is_current(path=SUGGESTION_SNAPSHOT_PATH, prefix_length=SUGGESTION_PREFIX_LENGTH):
+    with read_connection() as conn:
+        row = conn.execute("SELECT value FROM build_info WHERE key = 'suggestion_token'").fetchone()
+    if row is None or not row[0].startswith(f'{prefix_length}:'):
+        return False
+    try:
+        snapshot = SuggestionSnapshot(path)
+    except (OSError, ValueError):
+        return False
+    try:
+        return snapshot.header.get('token') == row[0]
+    finally:
+        snapshot.close()
+
+# Read-only view of a suggestion snapshot file. It only needs the standard
+# library, and the memory map is shared by every process reading the file.
+class SuggestionSnapshot:
+    def __init__(self, path=SUGGESTION_SNAPSHOT_PATH):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, header_length, self.count = SUGGESTION_FILE_HEADER.unpack_from(self._map)
+            if magic != SUGGESTION_FILE_MAGIC:
+                raise ValueError(f'{path} is not a suggestion snapshot')
+            header_start = SUGGESTION_FILE_HEADER.size
+            self.header = json.loads(self._map[header_start:header_start + header_length])
+            if self.header.get('version') != SUGGESTION_FILE_VERSION:
+                raise ValueError(f'{path} has snapshot version {self.header.get("version")}')
+        except (struct.error, ValueError):
+            self._map.close()
+            raise
+        self._offsets_start = header_start + header_length
+    
+    def _key(self, index):
+        offset, = SUGGESTION_OFFSET.unpack_from(self._map, self._offsets_start + index * SUGGESTION_OFFSET.size)
+        key_length, = SUGGESTION_KEY_LENGTH.unpack_from(self._map, offset)
+        key_start = offset + SUGGESTION_KEY_LENGTH.size
+        return self._map[key_start:key_start + key_length], key_start + key_length
+    
+    def lookup(self, query):
+        """Return the results of a query, or None if the snapshot does not hold its prefix"""
+        key = suggestion_key(query).encode('utf-8')
+        if not key:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        found, results_offset = self._key(low)
+        if found != key:
+            return None
+        results_length, = SUGGESTION_RESULTS_LENGTH.unpack_from(self._map, results_offset)
+        results_start = results_offset + SUGGESTION_RESULTS_LENGTH.size
+        return [tuple(row) for row in json.loads(self._map[results_start:results_start + results_length])]
+    
+    def __len__(self):
+        return self.count
+    
+    def close(self):
+        self._map.close()
+
+# FTS maintenance settings. Incremental writes add small FTS5 segments, and
+# every query has to read all of them until they are merged.
+FTS_MERGE_PAGES = 64  # Leaf pages merged per 'merge' step, which bounds each write transaction
+FTS_MERGE_BUDGET = 2.0  # Seconds of incremental merging per table and maintenance run
+FTS_AUTOMERGE = 4  # FTS5 default: merge once a level holds this many segments
+FTS_OPTIMIZE_INTERVAL = 7 * 24 * 3600  # Seconds between scheduled full optimizes
+FTS_PROBE_QUERIES = 20  # Prefix queries timed before and after each operation
+FTS_OPERATIONS = ('merge', 'optimize', 'automerge', 'integrity-check')
+
+# Function to report the segments and size of an FTS table
+def fts_index_stats(conn, table):
+    """Return the segment count, leaf pages and bytes of the index of an FTS table"""
+    segments = conn.execute(f'SELECT COUNT(DISTINCT segid) FROM {table}_idx').fetchone()[0]
+    pages, index_bytes = conn.execute(f'SELECT COUNT(*), COALESCE(SUM(LENGTH(block)), 0) FROM {table}_data').fetchone()
+    return {'segments': segments, 'pages': pages, 'index_bytes': index_bytes}
+
+# Function to pick prefix queries for timing an FTS table
+def fts_probe_queries(conn, table, count=FTS_PROBE_QUERIES):
+    """Return MATCH expressions of 1 to 4 character prefixes of indexed names"""
+    content_table = FTS_TABLES[table][0]
+    names = conn.execute(f'SELECT name FROM {content_table} WHERE name <> \'\' ORDER BY id LIMIT ?', (count,)).fetchall()
+    queries = []
+    for i, (name,) in enumerate(names):
+        prefix = ''.join(ch for ch in name.split(' ')[0].lower() if ch.isalnum())[:i % 4 + 1]
+        if prefix:
+            queries.append(f'"{prefix}"*')
+    return queries
+
+# Function to time prefix queries against an FTS table
+def fts_probe_latency(conn, table, queries):
+    """Run each query, record it under fts_probe.<table> and return mean and max milliseconds"""
+    metrics = get_query_metrics()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        rows = conn.execute(f'SELECT rowid FROM {table} WHERE {table} MATCH ? LIMIT 20', (query,)).fetchall()
+        latencies.append(time.perf_counter() - start)
+        metrics.record(f'fts_probe.{table}', latencies[-1], len(rows))
+    if not latencies:
+        return {'queries': 0}
+    return {
+        'queries': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'max_ms': max(latencies) * 1000
+    }
+
+# Function to merge the segments of an FTS table a few pages at a time
+def merge_fts_index(table, pages=FTS_MERGE_PAGES, time_budget=FTS_MERGE_BUDGET):
+    """Run 'merge' steps in separate short write transactions until no work is left or the budget is spent.
+    
+    Readers are never blocked in WAL mode, and the writer lock is released
+    between steps so other writes can go in between.
+    """
+    deadline = time.perf_counter() + time_budget
+    steps = 0
+    complete = False
+    while not complete and time.perf_counter() < deadline:
+        with write_connection() as conn:
+            changes = conn.total_changes
+            conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('merge', ?)", (pages,))
+            # FTS5 changes fewer than two rows when there was nothing to merge
+            complete = conn.total_changes - changes < 2
+        steps += 1
+    return {'steps': steps, 'complete': complete}
+
+# Function to run one maintenance operation on an FTS table
+def run_fts_operation(table, operation, pages=FTS_MERGE_PAGES, time_budget=FTS_MERGE_BUDGET, level=FTS_AUTOMERGE):
+    if operation == 'merge':
+        return merge_fts_index(table, pages, time_budget)
+    with write_connection() as conn:
+        if operation == 'optimize':
+            conn.execute(f"INSERT INTO {table}({table}) VALUES('optimize')")
+            return {}
+        if operation == 'automerge':
+            conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('automerge', ?)", (level,))
+            return {'level': level}
+        if operation == 'integrity-check':
+            try:
+                # rank 1 also checks the index against the external content table
+                conn.execute(f"INSERT INTO {table}({table}, rank) VALUES('integrity-check', 1)")
+                return {'ok': True}
+            except sqlite3.DatabaseError as e:
+                return {'ok': False, 'error': str(e)}
+    raise ValueError(f"Unknown FTS operation: {operation}")
+
+# Function to record a maintenance report in the database
+def log_fts_maintenance(report):
+    with write_connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fts_maintenance_log (
+                id INTEGER PRIMARY KEY,
+                ran_at TEXT,
+                fts_table TEXT,
+                operation TEXT,
+                report TEXT
+            )
+        ''')
+        conn.execute(
+            'INSERT INTO fts_maintenance_log (ran_at, fts_table, operation, report) VALUES (?, ?, ?, ?)',
+            (report['ran_at'], report['table'], report['operation'], json.dumps(report))
+        )
+
+# Function to run an FTS maintenance operation
+def maintain_fts(operation, tables=None, pages=FTS_MERGE_PAGES, time_budget=FTS_MERGE_BUDGET, level=FTS_AUTOMERGE):
+    """Run operation ('merge', 'optimize', 'automerge' or 'integrity-check') on each FTS table.
+    
+    Returns one report per table with its index statistics and the latency of
+    the same prefix queries before and after the operation.
+    """
+    if operation not in FTS_OPERATIONS:
+        raise ValueError(f"Unknown FTS operation: {operation}")
+    reports = []
+    for table in tables or FTS_TABLES:
+        with read_connection() as conn:
+            queries = fts_probe_queries(conn, table)
+            before = dict(fts_index_stats(conn, table), latency=fts_probe_latency(conn, table, queries))
+        
+        start = time.perf_counter()
+        with timed(f'maintain_fts.{operation}'):
+            result = run_fts_operation(table, operation, pages, time_budget, level)
+        seconds = time.perf_counter() - start
+        
+        with read_connection() as conn:
+            after = dict(fts_index_stats(conn, table), latency=fts_probe_latency(conn, table, queries))
+        report = {
+            'ran_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'table': table,
+            'operation': operation,
+            'seconds': seconds,
+            'result': result,
+            'before': before,
+            'after': after
+        }
+        log_fts_maintenance(report)
+        reports.append(report)
+    return reports
+
+# Function to run the periodic FTS maintenance, e.g. from cron
+def run_scheduled_fts_maintenance(optimize_interval=FTS_OPTIMIZE_INTERVAL, time_budget=FTS_MERGE_BUDGET):
+    """Merge fragmented indexes within the time budget, or optimize them if the last optimize is older than optimize_interval.
+    
+    A search index left unordered by a refresh is also rebuilt in ranked order first.
+    """
+    reports = []
+    with read_connection() as conn:
+        ordered = search_index_is_current(conn.cursor())
+    if not ordered:
+        start = time.perf_counter()
+        with write_connection() as conn:
+            rebuild_search_index(conn.cursor())
+        if SHARD_REGIONS:
+            build_search_shards()
+        get_search_cache().invalidate()
+        get_prefix_trie().built = False
+        reports.append({'table': 'search_fts', 'operation': 'reorder', 'seconds': time.perf_counter() - start})
+    
+    _, build_info = read_build_info()
+    last_optimized = float(build_info.get('fts_optimized_at', 0))
+    if time.time() - last_optimized >= optimize_interval:
+        reports.extend(maintain_fts('optimize'))
+        with write_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO build_info (key, value) VALUES ('fts_optimized_at', ?)",
+                (str(time.time()),)
+            )
+    else:
+        reports.extend(maintain_fts('merge', time_budget=time_budget))
+    return reports
+
+# Function to show the hidden diagnostics page
+def show_diagnostics():
+    import pandas as pd
+    
+    st.title("🩺 Diagnostics")
+    metrics = get_query_metrics()
+    snapshot = metrics.snapshot()
+    
+    st.subheader("Operations")
+    if snapshot['operations']:
+        st.dataframe(pd.DataFrame.from_dict(snapshot['operations'], orient='index'))
+    else:
+        st.write("No operations recorded yet.")
+    
+    st.subheader("Search Cache")
+    st.json(get_search_cache().stats())
+    
+    st.subheader("Write Queue")
+    st.json(get_write_queue().stats())
+    
+    st.subheader("FTS Indexes")
+    with read_connection() as conn:
+        st.dataframe(pd.DataFrame.from_dict(
+            {table: fts_index_stats(conn, table) for table in FTS_TABLES}, orient='index'
+        ))
+        try:
+            log = pd.read_sql_query('''
+                SELECT ran_at, fts_table, operation, report FROM fts_maintenance_log ORDER BY id DESC LIMIT 20
+            ''', conn)
+        except (sqlite3.Error, pd.errors.DatabaseError):
+            log = None  # No maintenance has run yet
+    if log is not None and len(log):
+        st.dataframe(log)
+    
+    st.subheader("Sampled Query Plans")
+    for operation, plan in snapshot['plans'].items():
+        with st.expander(operation):
+            st.code(plan['sql'], language='sql')
+            st.code('\n'.join(
+                f"{row['id']} {row['parent']} {row['detail']}" for row in plan['plan']
+            ))
+    
+    st.subheader(f"Slow Queries (over {SLOW_QUERY_MS} ms)")
+    if snapshot['slow_queries']:
+        st.dataframe(pd.DataFrame(snapshot['slow_queries']))
+    else:
+        st.write("No slow queries recorded.")
+    
+    st.download_button(
+        "Export metrics (JSON)",
+        json.dumps(snapshot, indent=2, default=str),
+        file_name="destination_search_metrics.json",
+        mime="application/json"
+    )
+    if st.button("Reset metrics"):
+        metrics.reset()
+        st.rerun()
 
 # Streamlit app
 def main():
@@ -717,8 +3473,14 @@ def main():
         initial_sidebar_state="collapsed"
     )
 
-    # Initialize the database
-    init_database()
+    # Initialize the database once per process; reruns only stat the data files
+    prepare_database(DATA_DIR, data_files_signature())
+    preload_pandas()
+    
+    # Hidden diagnostics page, opened with ?diagnostics=1
+    if st.query_params.get("diagnostics") == "1":
+        show_diagnostics()
+        return
     
     # Web interface
     st.title("🔍 Search Suggestion Sandbox")
@@ -727,19 +3489,7 @@ def main():
     st.sidebar.header("Factor Weight Configuration")
     
     # Get current weights from factor_weights table
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, hotel_count_weight, country_hotel_count_weight FROM factor_weights")
-    weights_data = cursor.fetchall()
-    conn.close()
-    
-    # Create dictionary of current weights by destination type
-    current_weights = {}
-    for dest_type, hotel_count_weight, country_hotel_count_weight in weights_data:
-        current_weights[dest_type] = {
-            'hotel_count_weight': hotel_count_weight,
-            'country_hotel_count_weight': country_hotel_count_weight
-        }
+    current_weights = get_weights()
     
     # Default values if no weights found (two-factor system)
     if 'city' not in current_weights:
@@ -747,6 +3497,12 @@ def main():
     if 'area' not in current_weights:
         current_weights['area'] = {'hotel_count_weight': 0.5, 'country_hotel_count_weight': 0.5}
     
+    # What-if weights of this session override the shared weights without touching the database
+    if 'session_weights' not in st.session_state:
+        st.session_state.session_weights = {}
+    session_weights = st.session_state.session_weights
+    current_weights.update(session_weights)
+    
     # Weight adjustment forms - one for each destination type
     st.sidebar.markdown("""
     Customize the importance of each factor for optimal search results:
@@ -781,19 +3537,40 @@ def main():
             if weight_sum > 0:
                 st.write(f"Weight Sum: {weight_sum:.2f}")
             
+            share_weights = st.checkbox("Save for all sessions", key=f"{dest_type}_share_weights")
+            
             submit_weights = st.form_submit_button(f"Update {dest_type.title()} Weights")
             
             if submit_weights:
-                if update_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
-                    st.sidebar.success(f"{dest_type.title()} weights updated successfully!")
+                if share_weights:
+                    if update_weights(dest_type, hotel_count_weight, country_hotel_count_weight):
+                        session_weights.pop(dest_type, None)
+                        current_weights[dest_type] = {
+                            'hotel_count_weight': hotel_count_weight,
+                            'country_hotel_count_weight': country_hotel_count_weight
+                        }
+                        st.sidebar.success(f"{dest_type.title()} weights updated successfully!")
+                    else:
+                        st.sidebar.error(f"Failed to update {dest_type.title()} weights. Make sure values are between 0 and 1.")
                 else:
-                    st.sidebar.error(f"Failed to update {dest_type.title()} weights. Make sure values are between 0 and 1.")
+                    session_weights[dest_type] = {
+                        'hotel_count_weight': hotel_count_weight,
+                        'country_hotel_count_weight': country_hotel_count_weight
+                    }
+                    current_weights[dest_type] = session_weights[dest_type]
+                    st.sidebar.success(f"{dest_type.title()} weights updated for this session!")
     
     # Search section
     query = st.text_input("Search for a destination:")
     if query:
-        results = search_destinations(query)
+        # Each keystroke reruns the script; the session's candidate sets narrow longer queries in memory
+        if 'refinement_cache' not in st.session_state:
+            st.session_state.refinement_cache = RefinementCache()
+        results = st.session_state.refinement_cache.search(query, current_weights if session_weights else None)
         if results:
+            # Usually already imported by preload_pandas()
+            import pandas as pd
+            
             # Create main results dataframe
             df = pd.DataFrame(results, columns=[
                 "Type", "Name", "Country", "City", "Area",
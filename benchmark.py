@@ -0,0 +1,358 @@
+"""Benchmark suite for loading, scoring and searching destinations
+
+Generates seeded synthetic CSV files in a scratch directory, runs the app's
+database functions against them and writes the timings as JSON:
+
+    python benchmark.py --destinations 100000 --output results.json
+    python benchmark.py --parse-sizes 100000,1000000,5000000 --parse-workers 8
+    python benchmark.py --regions 4
+"""
+import argparse
+import bisect
+import csv
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import app
+
+# Syllables used to build destination names, so that prefixes are shared the way real names share them
+SYLLABLES = [
+    'ba', 'ban', 'bang', 'ko', 'pa', 'par', 'ri', 'lon', 'don', 'to', 'kyo', 'new', 'york', 'sa', 'mui',
+    'chi', 'ang', 'mai', 'phu', 'ket', 'ber', 'lin', 'ma', 'dri', 'ro', 'me', 'se', 'oul', 'syd', 'ney'
+]
+
+# Share of search queries by prefix length; longer queries use the full first word
+PREFIX_LENGTHS = [(1, 0.10), (2, 0.20), (3, 0.25), (4, 0.20), (5, 0.10), (None, 0.15)]
+
+# Function to generate a destination name
+def random_name(rnd):
+    words = 1 if rnd.random() < 0.7 else 2
+    return ' '.join(
+        ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3))).title()
+        for _ in range(words)
+    )
+
+# Function to write the synthetic CSV files
+def generate_data(data_dir, countries=200, cities=10000, areas=90000, skew=1.2, unpublished=0.02, seed=42):
+    """Write country.csv, city.csv, area.csv and destination.csv; hotel counts follow a Pareto(skew) distribution"""
+    rnd = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    
+    hotels = lambda scale: int(rnd.paretovariate(skew) * scale)
+    # Popular countries and cities own most of the children, as in real inventories
+    country_weights = [1.0 / (rank + 1) ** skew for rank in range(countries)]
+    country_ids = list(range(1, countries + 1))
+    if app.SCORE_BOOST_COUNTRY_ID not in country_ids:
+        country_ids[-1] = app.SCORE_BOOST_COUNTRY_ID
+    
+    country_names = {}
+    with open(os.path.join(data_dir, 'country.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'total_hotels'])
+        for country_id in country_ids:
+            country_names[country_id] = f'{random_name(rnd)} {country_id}'
+            writer.writerow([country_id, country_names[country_id], 0])
+    
+    city_rows = []
+    with open(os.path.join(data_dir, 'city.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'country_id', 'total_hotels'])
+        city_countries = rnd.choices(country_ids, weights=country_weights, k=cities)
+        for city_id, country_id in enumerate(city_countries, 1):
+            city_rows.append((city_id, random_name(rnd), country_id))
+            writer.writerow([*city_rows[-1], hotels(20)])
+    
+    city_weights = [1.0 / (rank + 1) ** skew for rank in range(cities)]
+    area_rows = []
+    with open(os.path.join(data_dir, 'area.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'city_id', 'total_hotels'])
+        area_cities = rnd.choices(range(1, cities + 1), weights=city_weights, k=areas) if cities else []
+        for area_id, city_id in enumerate(area_cities, 1):
+            area_rows.append((area_id, random_name(rnd), city_id))
+            writer.writerow([*area_rows[-1], hotels(5)])
+    
+    with open(os.path.join(data_dir, 'destination.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'country_id', 'country_name', 'city_id', 'city_name', 'area_id', 'area_name', 'is_publish'])
+        is_publish = lambda: 0 if rnd.random() < unpublished else 1
+        for city_id, city_name, country_id in city_rows:
+            writer.writerow([city_id, country_id, country_names[country_id], city_id, city_name, '', '', is_publish()])
+        for area_id, area_name, city_id in area_rows:
+            _, city_name, country_id = city_rows[city_id - 1]
+            writer.writerow([cities + area_id, country_id, country_names[country_id], city_id, city_name, area_id, area_name, is_publish()])
+
+# Function to build a realistic mix of search queries
+def generate_queries(db_path, count=2000, seed=42):
+    """Sample prefixes of destination names, weighting destinations by their hotel count"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT name, hotel_count FROM search_index').fetchall()
+    conn.close()
+    if not rows:
+        return []
+    
+    names = [name for name, _ in rows]
+    cumulative_weights = []
+    total = 0
+    for _, hotel_count in rows:
+        total += (hotel_count or 0) + 1
+        cumulative_weights.append(total)
+    lengths, length_weights = zip(*PREFIX_LENGTHS)
+    
+    queries = []
+    for _ in range(count):
+        roll = rnd.random()
+        if roll < 0.05:
+            # Queries without results
+            queries.append(''.join(rnd.choice('qxz') for _ in range(rnd.randint(2, 5))))
+            continue
+        name = names[bisect.bisect_left(cumulative_weights, rnd.random() * total)]
+        if roll < 0.10 and ' ' in name:
+            # Two-word queries with a partial second word
+            first, second = name.split(' ', 1)
+            queries.append(f'{first} {second[:rnd.randint(1, len(second))]}')
+            continue
+        first = name.split(' ')[0]
+        length = rnd.choices(lengths, weights=length_weights)[0] or len(first)
+        query = first[:length]
+        queries.append(query.lower() if rnd.random() < 0.5 else query)
+    return queries
+
+# Inputs that used to be invalid FTS5 syntax or expensive to search
+ADVERSARIAL_QUERIES = [
+    'a', 'b', 'M', '"', '""', "it's", 'ban"', 'ban*', '*', '-', '^ban', '(ban', 'ban)', 'x AND', 'AND', 'OR ban',
+    'NOT a', 'a NOT b', 'NEAR(a b)', 'name:ban', '{name}: a', 'ban -kok', 'new-york', "' OR 1=1 --", '%', '_',
+    'São', 'ñ', '北京', '🙂', 'a b c d e f g h i j k l m n o p', 'a ' * 60, 'ba' * 200, 'x' * 100000
+]
+
+# Function to build adversarial search queries: fixed syntax edge cases, long
+# runs of common words and random strings of letters and FTS5 syntax characters
+def generate_adversarial_queries(count=400, seed=42):
+    rnd = random.Random(seed)
+    queries = list(ADVERSARIAL_QUERIES)
+    while len(queries) < count:
+        if rnd.random() < 0.25:
+            queries.append(' '.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 12))))
+        else:
+            queries.append(''.join(rnd.choice('abkmnoprsty"*:^()-+ ') for _ in range(rnd.randint(1, 30))))
+    return queries
+
+# Function to summarize a list of latencies in seconds
+def summarize(latencies):
+    """Return count, mean and p50/p95/p99/max latencies in milliseconds"""
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    percentile = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000
+    return {
+        'count': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'max_ms': ordered[-1] * 1000
+    }
+
+# Function to get the peak resident set size of this process
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+# Function to time repeated calls of a function
+def time_calls(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+# Function to time serial and parallel parsing of destination.csv at several sizes
+def benchmark_parsing(sizes, workers, seed=42):
+    """Return the parse time of each size with read_csv_batches and with read_csv_parallel"""
+    results = []
+    for size in sizes:
+        data_dir = f'parse-{size}'
+        cities = max(1, size // 10)
+        generate_data(data_dir, cities=cities, areas=size - cities, seed=seed)
+        
+        start = time.perf_counter()
+        serial = app.DestinationTable()
+        for batch in app.read_csv_batches('destination.csv', app.parse_destination_row, data_dir):
+            serial.extend(batch)
+        serial_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        parallel = app.DestinationTable()
+        for table in app.read_csv_parallel('destination.csv', app.parse_destination_row, app.DestinationTable,
+                                           data_dir, workers, min_bytes=0):
+            parallel.extend(table)
+        parallel_seconds = time.perf_counter() - start
+        
+        results.append({
+            'rows': len(serial),
+            'bytes': os.path.getsize(os.path.join(data_dir, 'destination.csv')),
+            'workers': workers,
+            'serial_seconds': serial_seconds,
+            'parallel_seconds': parallel_seconds,
+            'speedup': serial_seconds / parallel_seconds,
+            'same_rows': len(parallel) == len(serial)
+        })
+    return results
+
+# Function to run the benchmark in a scratch directory
+def run_benchmark(options):
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='destination-benchmark-')
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    for path in (app.DB_PATH, app.DB_PATH + '-wal', app.DB_PATH + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    # Drop process-wide objects in case the app was used before in this process
+    app.get_connection_pool.clear()
+    app.get_search_cache.clear()
+    app.get_weights_cache.clear()
+    app.get_prefix_trie.clear()
+    app.get_popular_destinations.clear()
+    
+    # Split the countries round-robin into region shards
+    if options.regions:
+        app.SHARD_REGIONS = {
+            f'region{region}': list(range(region + 1, options.countries + 1, options.regions))
+            for region in range(options.regions)
+        }
+    
+    cities = options.cities if options.cities is not None else max(1, options.destinations // 10)
+    areas = max(0, options.destinations - cities)
+    results = {
+        'config': {
+            'destinations': cities + areas,
+            'countries': options.countries,
+            'cities': cities,
+            'areas': areas,
+            'skew': options.skew,
+            'seed': options.seed,
+            'queries': options.queries,
+            'scoring_mode': app.SCORING_MODE,
+            'fts_tokenizer': app.FTS_TOKENIZER,
+            'regions': options.regions
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform()
+        },
+        'phases': {}
+    }
+    phases = results['phases']
+    
+    start = time.perf_counter()
+    generate_data('data', options.countries, cities, areas, options.skew, seed=options.seed)
+    phases['generate_data'] = {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+    
+    start = time.perf_counter()
+    app.load_csv_data('data')
+    phases['load_csv_data'] = {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+    
+    start = time.perf_counter()
+    app.init_database()
+    seconds = time.perf_counter() - start
+    phases['init_database'] = {
+        'seconds': seconds,
+        'rows_per_second': (cities + areas) / seconds,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    
+    rnd = random.Random(options.seed)
+    weight_args = [
+        (dest_type, round(rnd.random(), 2), round(rnd.random(), 2))
+        for dest_type in ('city', 'area') for _ in range(options.weight_updates)
+    ]
+    phases['update_weights'] = dict(summarize(time_calls(app.update_weights, weight_args)), peak_rss_mb=peak_rss_mb())
+    
+    queries = generate_queries(app.DB_PATH, options.queries, options.seed)
+    query_args = [(query,) for query in queries]
+    # Uncached latency first, then the same mix through the result cache
+    phases['query_destinations'] = dict(summarize(time_calls(app.query_destinations, query_args)), peak_rss_mb=peak_rss_mb())
+    # Searches with other weights sort all their matches, and are the ones split across region shards
+    weights = {
+        dest_type: dict(w, hotel_count_weight=round(1 - w['hotel_count_weight'], 2))
+        for dest_type, w in app.get_weights().items()
+    }
+    phases['query_destinations_sorted'] = dict(
+        summarize(time_calls(app.query_destinations, [(query, weights) for query in queries])),
+        peak_rss_mb=peak_rss_mb()
+    )
+    app.get_search_cache().invalidate()
+    phases['search_destinations'] = dict(
+        summarize(time_calls(app.search_destinations, query_args)),
+        cache=app.get_search_cache().stats(),
+        peak_rss_mb=peak_rss_mb()
+    )
+    
+    # Worst-case inputs, each searched uncached with the shared and with other weights
+    adversarial_latencies = []
+    adversarial_errors = 0
+    for query in generate_adversarial_queries(seed=options.seed):
+        for query_weights in (None, weights):
+            app.get_search_cache().invalidate()
+            start = time.perf_counter()
+            try:
+                app.search_destinations(query, query_weights)
+            except sqlite3.Error:
+                adversarial_errors += 1
+            adversarial_latencies.append(time.perf_counter() - start)
+    phases['search_destinations_adversarial'] = dict(
+        summarize(adversarial_latencies), errors=adversarial_errors, peak_rss_mb=peak_rss_mb()
+    )
+    
+    if options.parse_sizes:
+        sizes = [int(size) for size in options.parse_sizes.split(',')]
+        results['csv_parsing'] = benchmark_parsing(sizes, options.parse_workers, options.seed)
+    
+    results['database_bytes'] = os.path.getsize(app.DB_PATH)
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark destination loading, scoring and search')
+    parser.add_argument('--destinations', type=int, default=100000, help='number of city and area destinations')
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--cities', type=int, default=None, help='defaults to 10%% of the destinations')
+    parser.add_argument('--skew', type=float, default=1.2, help='Pareto/Zipf exponent of hotel counts and popularity')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--weight-updates', type=int, default=5, help='update_weights calls per destination type')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--parse-sizes', default=None, help='comma-separated destination counts to time parallel CSV parsing at, e.g. 100000,1000000')
+    parser.add_argument('--parse-workers', type=int, default=max(2, app.PARSE_WORKERS), help='worker processes of the parallel parser')
+    parser.add_argument('--regions', type=int, default=0, help='split the search tables into this many region shards')
+    parser.add_argument('--work-dir', default=None, help='scratch directory, a new temporary one by default')
+    parser.add_argument('--output', default=None, help='JSON output file, stdout by default')
+    options = parser.parse_args()
+    
+    output = os.path.abspath(options.output) if options.output else None
+    results = run_benchmark(options)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
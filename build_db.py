@@ -0,0 +1,46 @@
+"""Compile the CSV files in data/ into the destinations.db artifact
+
+    python build_db.py [--data-dir data] [--force]
+    python build_db.py --delta nightly/
+
+The app refreshes the artifact in place when the data files change and rebuilds
+it when its schema version or build settings change; running this ahead of a
+deploy keeps that work off the request path. --delta applies CSV files holding
+only changed, added or unpublished rows.
+"""
+import argparse
+import time
+
+import app
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the destinations database artifact')
+    parser.add_argument('--data-dir', default=app.DATA_DIR)
+    parser.add_argument('--force', action='store_true', help='rebuild even if the artifact is current')
+    parser.add_argument('--delta', default=None, help='directory of CSV files to apply to the artifact')
+    options = parser.parse_args()
+    
+    start = time.perf_counter()
+    if options.delta:
+        stats = app.refresh_data(delta_dir=options.delta)
+        print(f"Applied {options.delta} to {app.DB_PATH} in {time.perf_counter() - start:.2f}s: {stats}")
+        return
+    
+    status = 'rebuild' if options.force else app.database_status(options.data_dir)
+    if status == 'current':
+        print(f"{app.DB_PATH} is current, nothing to do")
+        return
+    if status == 'stale_data':
+        stats = app.refresh_data(options.data_dir)
+        print(f"Refreshed {app.DB_PATH} in {time.perf_counter() - start:.2f}s: {stats}")
+        return
+    
+    app.build_database(options.data_dir)
+    schema_version, build_info = app.read_build_info()
+    print(
+        f"Built {app.DB_PATH} (schema {schema_version}, input hash {build_info['input_hash'][:12]}) "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+if __name__ == '__main__':
+    main()
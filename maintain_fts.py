@@ -0,0 +1,42 @@
+"""Report on and maintain the FTS5 indexes of destinations.db
+
+    python maintain_fts.py stats
+    python maintain_fts.py merge [--pages 64] [--budget 2]
+    python maintain_fts.py optimize [--table city_fts]
+    python maintain_fts.py automerge --level 8
+    python maintain_fts.py integrity-check
+    python maintain_fts.py scheduled [--interval 604800]
+
+Refreshes add small segments to the FTS indexes. 'merge' merges them a few
+pages per write transaction within a time budget, 'optimize' merges each index
+into a single segment, and 'scheduled' (meant for cron) merges on every run and
+optimizes once the interval has passed. Every operation reports the segment
+count, index size and prefix query latency of each table before and after.
+"""
+import argparse
+import json
+
+import app
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the FTS5 indexes of the destinations database')
+    parser.add_argument('operation', choices=('stats', 'scheduled') + app.FTS_OPERATIONS)
+    parser.add_argument('--table', action='append', choices=list(app.FTS_TABLES), help='repeatable, all tables by default')
+    parser.add_argument('--pages', type=int, default=app.FTS_MERGE_PAGES, help='pages merged per merge step')
+    parser.add_argument('--budget', type=float, default=app.FTS_MERGE_BUDGET, help='seconds of merging per table')
+    parser.add_argument('--level', type=int, default=app.FTS_AUTOMERGE, help='automerge level, 0 disables it')
+    parser.add_argument('--interval', type=float, default=app.FTS_OPTIMIZE_INTERVAL, help='seconds between scheduled optimizes')
+    options = parser.parse_args()
+    
+    app.init_database()
+    if options.operation == 'stats':
+        with app.read_connection() as conn:
+            result = {table: app.fts_index_stats(conn, table) for table in options.table or app.FTS_TABLES}
+    elif options.operation == 'scheduled':
+        result = app.run_scheduled_fts_maintenance(options.interval, options.budget)
+    else:
+        result = app.maintain_fts(options.operation, options.table, options.pages, options.budget, options.level)
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Headless JSON search service for autocomplete widgets
+
+Serves the same database as the Streamlit app without re-running the UI
+script per request. Uses only the standard library:
+
+    python server.py --port 8080
+
+    GET  /search?q=ban          top 20 destinations for a query
+    POST /weights               {"type": "city", "hotel_count_weight": 0.8, "country_hotel_count_weight": 0.05}
+    GET  /weights               shared factor weights
+    GET  /metrics               query metrics, search cache and write queue statistics
+    GET  /health
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import app
+
+# Names of the columns returned by search_destinations
+RESULT_COLUMNS = [
+    'type', 'name', 'country_name', 'city_name', 'area_name', 'hotel_count',
+    'hotel_count_normalized', 'country_hotel_count_normalized', 'total_score',
+    'hotel_count_weight', 'country_hotel_count_weight', 'country_total_hotels'
+]
+
+# Service settings
+EXECUTOR_WORKERS = app.READ_POOL_SIZE  # One worker per pooled read connection
+MAX_PENDING = 256  # Database requests queued beyond this are rejected with 503
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 15  # Seconds an idle connection is kept open
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+# Search service: answers from the trie or the result cache on the event loop,
+# runs database searches on a bounded thread pool and shares one database
+# search between concurrent requests for the same normalized query.
+class SearchService:
+    def __init__(self, workers=EXECUTOR_WORKERS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.coalesced = 0
+        self._in_flight = {}
+    
+    async def run_blocking(self, func, *args):
+        """Run blocking SQLite work on the executor, rejecting work beyond the queue bound"""
+        if self.pending >= self.max_pending:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, 'Too many pending requests')
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+    
+    async def search(self, query):
+        results = app.trie_search(query) if app.AUTOCOMPLETE_TRIE and app.get_prefix_trie().built else None
+        # Short trie results are completed with fuzzy matches by search_destinations
+        if results is not None and (len(results) >= app.FUZZY_MIN_RESULTS or not app.FUZZY_SEARCH):
+            return results
+        
+        cache = app.get_search_cache()
+        key = cache.key(query)
+        results = cache.get(key)
+        if results is not None:
+            return results
+        
+        # Identical in-flight queries wait for the same future
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            results = await self.run_blocking(app.search_destinations, query)
+            future.set_result(results)
+            return results
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when no other request is waiting
+            raise
+        finally:
+            del self._in_flight[key]
+    
+    async def handle(self, method, path, params, body):
+        """Return the (status, payload) of an API request"""
+        if path == '/search' and method == 'GET':
+            query = params.get('q', [''])[0]
+            if not query.strip():
+                return HTTPStatus.OK, {'query': query, 'results': []}
+            results = await self.search(query)
+            return HTTPStatus.OK, {
+                'query': query,
+                'results': [dict(zip(RESULT_COLUMNS, row)) for row in results]
+            }
+        
+        if path == '/weights' and method == 'GET':
+            return HTTPStatus.OK, await self.run_blocking(app.get_weights)
+        
+        if path == '/weights' and method == 'POST':
+            try:
+                data = json.loads(body or b'{}')
+                dest_type = data['type']
+                hotel_count_weight = float(data['hotel_count_weight'])
+                country_hotel_count_weight = float(data['country_hotel_count_weight'])
+            except (ValueError, KeyError, TypeError) as e:
+                raise HttpError(HTTPStatus.BAD_REQUEST, f'Invalid weights: {e}')
+            future = app.submit_weights(dest_type, hotel_count_weight, country_hotel_count_weight)
+            if future is None:
+                raise HttpError(HTTPStatus.BAD_REQUEST, 'Weights must be between 0 and 1 for type city or area')
+            # Applied by the app's writer thread, so no executor worker waits for it
+            await asyncio.wrap_future(future)
+            return HTTPStatus.OK, await self.run_blocking(app.get_weights)
+        
+        if path == '/metrics' and method == 'GET':
+            metrics = app.get_query_metrics().snapshot()
+            metrics['search_cache'] = app.get_search_cache().stats()
+            metrics['write_queue'] = app.get_write_queue().stats()
+            metrics['service'] = {'pending': self.pending, 'coalesced': self.coalesced}
+            return HTTPStatus.OK, metrics
+        
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, {'status': 'ok'}
+        
+        if path in ('/search', '/weights', '/metrics', '/health'):
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+        raise HttpError(HTTPStatus.NOT_FOUND)
+    
+    async def serve_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it is closed"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, {'error': 'Headers too large'}, False)
+                    break
+                
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'Malformed request line'}, False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                try:
+                    length = int(headers.get('content-length', 0))
+                    if length > MAX_BODY_BYTES:
+                        raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    body = await reader.readexactly(length) if length else b''
+                    url = urlsplit(target)
+                    status, payload = await self.handle(method, url.path, parse_qs(url.query), body)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except ValueError:
+                    status, payload = HTTPStatus.BAD_REQUEST, {'error': 'Invalid Content-Length'}
+                except Exception as e:
+                    print(f"Error handling {method} {target}: {e}")
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Internal error'}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+    
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+            f'\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+
+async def serve(host, port):
+    # Load the database once per process, not once per request
+    app.init_database()
+    service = SearchService()
+    server = await asyncio.start_server(service.serve_connection, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving destination search on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve destination search as a JSON API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    options = parser.parse_args()
+    try:
+        asyncio.run(serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
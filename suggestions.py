@@ -0,0 +1,40 @@
+"""Compile and query the static suggestion snapshot
+
+    python suggestions.py build [--length 4] [--output suggestions.bin]
+    python suggestions.py lookup ban [--output suggestions.bin]
+
+'build' runs the search of every prefix of up to --length characters that
+starts a word of the indexed names, with the shared weights, and writes the
+top 20 results of each to a sorted, length-prefixed file. 'lookup' answers a
+query from that file with a binary search, without opening the database.
+Set SUGGESTION_SNAPSHOT in app.py to recompile it after every data reload and
+weight update.
+"""
+import argparse
+import json
+import time
+
+import app
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile or query the static suggestion snapshot')
+    parser.add_argument('operation', choices=('build', 'lookup'))
+    parser.add_argument('query', nargs='?', default='', help='query to look up')
+    parser.add_argument('--length', type=int, default=app.SUGGESTION_PREFIX_LENGTH, help='longest prefix compiled')
+    parser.add_argument('--output', default=app.SUGGESTION_SNAPSHOT_PATH)
+    options = parser.parse_args()
+    
+    if options.operation == 'lookup':
+        snapshot = app.SuggestionSnapshot(options.output)
+        results = snapshot.lookup(options.query)
+        snapshot.close()
+        print(json.dumps(results, indent=2))
+        return
+    
+    start = time.perf_counter()
+    app.init_database()
+    count = app.compile_suggestion_snapshot(options.output, options.length)
+    print(f"Compiled {count} prefixes into {options.output} in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+# Process-wide objects that belong to one database
+PROCESS_OBJECTS = (
+    app.get_connection_pool, app.get_search_cache, app.get_weights_cache, app.get_prefix_trie,
+    app.get_fuzzy_index, app.get_popular_destinations, app.get_write_queue, app.get_query_metrics, app.file_content_hash
+)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run a test in an empty directory with fresh process-wide objects"""
+    monkeypatch.chdir(tmp_path)
+    for getter in PROCESS_OBJECTS:
+        getter.clear()
+    yield tmp_path
+    for getter in PROCESS_OBJECTS:
+        getter.clear()
+
+# Destinations with Thai, Vietnamese and ASCII names, including FTS5 keywords and quotes
+COUNTRIES = [(1, 'ประเทศไทย'), (2, 'Việt Nam'), (3, 'United States')]
+CITIES = [
+    (1, 'กรุงเทพมหานคร', 1, 500), (2, 'เชียงใหม่', 1, 200), (3, 'Hà Nội', 2, 300), (4, 'Đà Nẵng', 2, 150),
+    (5, 'Hồ Chí Minh', 2, 350), (6, 'New York', 3, 900), (7, 'Newark', 3, 100), (8, 'Norfolk', 3, 50)
+]
+AREAS = [
+    (1, 'สุขุมวิท', 1, 120), (2, 'สีลม', 1, 80), (3, 'Hoàn Kiếm', 3, 90), (4, 'Ba Đình', 3, 40),
+    (5, 'Times Square', 6, 200), (6, 'Near North', 6, 30), (7, "Hell's Kitchen", 6, 60), (8, 'Nội Bài', 3, 10)
+]
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+@pytest.fixture
+def international_database(workdir):
+    """Build destinations.db from the destinations above"""
+    os.makedirs('data')
+    countries = dict(COUNTRIES)
+    cities = {city_id: (name, country_id) for city_id, name, country_id, _ in CITIES}
+    write_csv('data/country.csv', ['id', 'name', 'total_hotels'], [(country_id, name, 0) for country_id, name in COUNTRIES])
+    write_csv('data/city.csv', ['id', 'name', 'country_id', 'total_hotels'], CITIES)
+    write_csv('data/area.csv', ['id', 'name', 'city_id', 'total_hotels'], AREAS)
+    destinations = [
+        (city_id, country_id, countries[country_id], city_id, name, '', '', 1)
+        for city_id, name, country_id, _ in CITIES
+    ] + [
+        (100 + area_id, cities[city_id][1], countries[cities[city_id][1]], city_id, cities[city_id][0], area_id, name, 1)
+        for area_id, name, city_id, _ in AREAS
+    ]
+    write_csv(
+        'data/destination.csv',
+        ['id', 'country_id', 'country_name', 'city_id', 'city_name', 'area_id', 'area_name', 'is_publish'],
+        destinations
+    )
+    app.init_database('data')
+    return workdir
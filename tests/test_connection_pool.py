@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def create_database(path, value):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('CREATE TABLE t (v INTEGER)')
+    conn.execute('INSERT INTO t VALUES (?)', (value,))
+    conn.commit()
+    conn.close()
+
+def read_value(pool):
+    with pool.reader() as conn:
+        return conn.execute('SELECT v FROM t').fetchone()[0]
+
+def test_swap_in_process_keeps_pooled_readers_current(workdir):
+    create_database('live.db', 1)
+    pool = app.ConnectionPool('live.db')
+    assert read_value(pool) == 1
+    
+    create_database('live.db.build', 2)
+    pool.swap('live.db.build')
+    assert read_value(pool) == 2
+    assert not os.path.exists('live.db.build')
+
+def test_swap_by_another_process_is_seen_by_pooled_readers(workdir):
+    create_database('live.db', 1)
+    pool = app.ConnectionPool('live.db')
+    assert read_value(pool) == 1
+    with pool.writer() as conn:
+        conn.execute('UPDATE t SET v = 3')
+    inode = os.stat('live.db').st_ino
+    
+    create_database('live.db.build', 2)
+    subprocess.run([
+        sys.executable, '-c',
+        f'import sys; sys.path.insert(0, {ROOT!r}); import app; app.ConnectionPool("live.db").swap("live.db.build")'
+    ], check=True, capture_output=True)
+    
+    # Same file and journal, so the pooled connections read the new database
+    assert os.stat('live.db').st_ino == inode
+    assert read_value(pool) == 2
+    with pool.writer() as conn:
+        conn.execute('UPDATE t SET v = 4')
+    assert read_value(pool) == 4
+
+def test_failed_opens_do_not_use_up_the_pool(workdir):
+    pool = app.ConnectionPool('missing.db', size=2)
+    for _ in range(pool.size + 1):
+        with pytest.raises(sqlite3.OperationalError):
+            read_value(pool)
+    
+    # The slots are free again, so the next call opens a connection instead of waiting
+    create_database('missing.db', 5)
+    assert read_value(pool) == 5
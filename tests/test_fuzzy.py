@@ -0,0 +1,42 @@
+import app
+
+# Function to build the fuzzy index the way the first search does, and wait for it
+def build_fuzzy_index():
+    assert app.ready_fuzzy_index() is None
+    index = app.get_fuzzy_index()
+    with index._lock:
+        assert index.built
+    return index
+
+def names(results):
+    return [result[1] for result in results]
+
+def test_one_edit_misspellings_find_the_destination(international_database):
+    build_fuzzy_index()
+    # A swap, a deletion, an insertion and a substitution
+    assert 'Newark' in names(app.search_destinations('newrak'))
+    assert 'Times Square' in names(app.search_destinations('tmes sq'))
+    assert 'Norfolk' in names(app.search_destinations('norrfolk'))
+    assert 'Times Square' in names(app.search_destinations('times sqiare'))
+
+def test_invalidated_index_gives_no_corrections_until_rebuilt(international_database):
+    index = build_fuzzy_index()
+    assert 'Newark' in names(app.search_destinations('newrak'))
+    
+    index.invalidate()
+    app.get_search_cache().invalidate()
+    # The first search starts the rebuild and gets the exact results, uncached
+    assert app.search_destinations('newrak') == []
+    with index._lock:
+        assert index.built
+    assert 'Newark' in names(app.search_destinations('newrak'))
+
+def test_searches_over_the_time_budget_return_exact_results_uncached(international_database, monkeypatch):
+    build_fuzzy_index()
+    monkeypatch.setattr(app, 'PROGRESS_STEPS', 1)
+    monkeypatch.setattr(app, 'FUZZY_TIME_BUDGET', -1)
+    assert app.search_destinations('newrak') == []
+    assert app.get_query_metrics().snapshot()['operations']['fuzzy_search.timeout']['calls'] == 1
+    
+    monkeypatch.setattr(app, 'FUZZY_TIME_BUDGET', 1)
+    assert 'Newark' in names(app.search_destinations('newrak'))
@@ -0,0 +1,42 @@
+import pytest
+
+import app
+
+HEADER = 'id,country_id,country_name,city_id,city_name,area_id,area_name,is_publish'
+
+# Function to write destination rows whose quoted names hold commas, doubled quotes and line breaks
+def write_destinations(path, newline):
+    lines = [HEADER]
+    for i in range(1, 301):
+        if i % 3 == 0:
+            city_name = f'"Port {i},{newline}""Old"" Town{newline}{newline}North"'
+        elif i % 3 == 1:
+            city_name = f'"{i}"""'
+        else:
+            city_name = f'City {i}'
+        area = f'{i},"Area{newline}{i}"' if i % 5 == 0 else ','
+        lines.append(f'{i},{i % 7 + 1},"Country, {i % 7}",{i},{city_name},{area},1')
+        if i % 50 == 0:
+            lines.append(f'x{i},1,Invalid,1,Invalid,,,1')  # Skipped by both parsers
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(newline.join(lines) + newline)
+
+def destination_tuples(destinations):
+    return [tuple(getattr(d, name) for name in app.Destination.__slots__) for d in destinations]
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_parallel_parse_matches_serial_parse(tmp_path, monkeypatch, newline):
+    write_destinations(tmp_path / 'destination.csv', newline)
+    # Small chunks and scan blocks, so boundaries fall inside quoted fields
+    monkeypatch.setattr(app, 'PARSE_CHUNK_BYTES', 256)
+    monkeypatch.setattr(app, 'CHUNK_SCAN_BYTES', 16)
+    _, chunks = app.csv_chunk_offsets(str(tmp_path / 'destination.csv'))
+    assert len(chunks) > 10
+    
+    serial = [d for batch in app.read_csv_batches('destination.csv', app.parse_destination_row, str(tmp_path)) for d in batch]
+    tables = app.read_csv_parallel(
+        'destination.csv', app.parse_destination_row, app.DestinationTable, str(tmp_path), workers=2, min_bytes=0
+    )
+    parallel = [d for table in tables for d in table]
+    assert len(serial) == 300
+    assert destination_tuples(parallel) == destination_tuples(serial)
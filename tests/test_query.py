@@ -0,0 +1,52 @@
+import pytest
+
+import app
+
+# Function to find matches as the search did before queries were compiled:
+# the raw input with a trailing * in each column, which is valid FTS5 syntax
+# for plain words in any script
+def old_match(query):
+    pattern = f'{query}*'
+    with app.read_connection() as conn:
+        rows = conn.execute('''
+            SELECT si.type, si.name FROM search_fts
+            JOIN search_index si ON si.id = search_fts.rowid
+            WHERE search_fts MATCH ?
+        ''', (f'name : ({pattern}) OR parent_name : ({pattern})',)).fetchall()
+    return set(rows)
+
+def matches(query):
+    return {(result[0], result[1]) for result in app.query_destinations(query)}
+
+@pytest.mark.parametrize('query', [
+    'กรุงเทพ', 'กรุง', 'สุขุมวิท', 'เชียง', 'Hà Nội', 'Nội', 'Đà Nẵng', 'Việt', 'HÀ NỘI', 'Hồ Chí', 'ha'
+])
+def test_non_ascii_queries_match_like_the_raw_query(international_database, query):
+    expected = old_match(query)
+    assert expected
+    assert matches(query) == expected
+    assert {(result[0], result[1]) for result in app.search_destinations(query)} >= expected
+
+# Inputs with FTS5 syntax, and the plain query each must match like (None: no matches)
+ADVERSARIAL_QUERIES = [
+    ('"new', 'new'), ('new*', 'new'), ('(new)', 'new'), ('new-york', 'new york'), ('NEAR', 'near'),
+    ('near NORTH', 'near north'), ("hell's", 'hell s'), ('"Hà', 'Hà'), ('Nội"', 'Nội'), ('name:new', 'name new'),
+    ('new NOT york', 'new not york'), ('"', None), ('*', None), ('-', None), ('(', None), (')', None),
+    ('""', None), ('( )', None), ('AND', None), (') new', 'new')
+]
+
+@pytest.mark.parametrize('query, plain_query', ADVERSARIAL_QUERIES)
+def test_adversarial_queries_match_as_plain_text(international_database, query, plain_query):
+    expected = old_match(plain_query) if plain_query else set()
+    assert matches(query) == expected
+    assert {(result[0], result[1]) for result in app.search_destinations(query)} >= expected
+
+def test_long_queries_are_cut():
+    assert app.query_terms('new ' * 100) == ('new',) * app.QUERY_MAX_TERMS
+    assert app.query_terms('x' * 1000) == ('x' * app.QUERY_MAX_CHARS,)
+
+def test_query_terms_cache_keys_are_cut():
+    app._query_terms.cache_clear()
+    for length in range(300, 310):
+        app.query_terms('y' * length)
+    assert app._query_terms.cache_info().currsize == 1
@@ -0,0 +1,28 @@
+import pytest
+
+import app
+
+SESSION_WEIGHTS = {
+    'city': {'hotel_count_weight': 0.2, 'country_hotel_count_weight': 0.8},
+    'area': {'hotel_count_weight': 0.9, 'country_hotel_count_weight': 0.1}
+}
+
+# Function to list the queries typed on the way to a text, from the first one the cache refines
+def typed(text):
+    return [text[:length] for length in range(app.QUERY_MIN_PREFIX_LENGTH, len(text) + 1)]
+
+@pytest.mark.parametrize('text', [
+    'ha noi', 'ha nội', 'Hà Nội', 'Đà Nẵng', 'สุขุมวิท', 'กรุงเทพ', 'Hoàn Kiếm', 'ba đình', 'nội bài', 'new york', 'hell'
+])
+def test_refined_results_match_uncached_search(international_database, monkeypatch, text):
+    monkeypatch.setattr(app, 'FUZZY_SEARCH', False)
+    cache = app.RefinementCache()
+    for query in typed(text):
+        assert cache.search(query, SESSION_WEIGHTS) == app.query_destinations(query, SESSION_WEIGHTS), query
+
+def test_plain_queries_over_ascii_names_are_refined(international_database, monkeypatch):
+    monkeypatch.setattr(app, 'FUZZY_SEARCH', False)
+    cache = app.RefinementCache()
+    for query in typed('times square'):
+        assert cache.search(query, SESSION_WEIGHTS) == app.query_destinations(query, SESSION_WEIGHTS), query
+    assert cache.refined > 0
@@ -0,0 +1,78 @@
+import csv
+import os
+import shutil
+
+import pytest
+
+import app
+import benchmark
+from conftest import PROCESS_OBJECTS
+
+# Function to read a CSV file as its header and rows
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+def write_rows(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+# Functions to change the data files. Hotel counts are copied from existing
+# rows, so the changed rows tie with others on score and hotel count.
+def insert_rows(data_dir):
+    header, cities = read_rows(os.path.join(data_dir, 'city.csv'))
+    new_city = [str(len(cities) + 1000), cities[0][1], cities[1][2], cities[1][3]]
+    write_rows(os.path.join(data_dir, 'city.csv'), header, cities + [new_city])
+    header, areas = read_rows(os.path.join(data_dir, 'area.csv'))
+    new_area = [str(len(areas) + 1000), areas[0][1], new_city[0], areas[1][3]]
+    write_rows(os.path.join(data_dir, 'area.csv'), header, areas + [new_area])
+    header, destinations = read_rows(os.path.join(data_dir, 'destination.csv'))
+    next_id = len(destinations) + 1000
+    destinations.append([str(next_id), new_city[2], '', new_city[0], new_city[1], '', '', '1'])
+    destinations.append([str(next_id + 1), new_city[2], '', new_city[0], new_city[1], new_area[0], new_area[1], '1'])
+    write_rows(os.path.join(data_dir, 'destination.csv'), header, destinations)
+
+def delete_rows(data_dir):
+    header, areas = read_rows(os.path.join(data_dir, 'area.csv'))
+    write_rows(os.path.join(data_dir, 'area.csv'), header, areas[::2])
+    header, destinations = read_rows(os.path.join(data_dir, 'destination.csv'))
+    write_rows(os.path.join(data_dir, 'destination.csv'), header, destinations[1::2])
+
+def raise_global_max(data_dir):
+    header, cities = read_rows(os.path.join(data_dir, 'city.csv'))
+    top = max(cities, key=lambda row: int(row[3]))
+    top[3] = str(int(top[3]) * 2)
+    write_rows(os.path.join(data_dir, 'city.csv'), header, cities)
+
+# Function to get the search results of every query, bypassing the caches
+def search_all(queries):
+    custom_weights = {
+        'city': {'hotel_count_weight': 0.2, 'country_hotel_count_weight': 0.8},
+        'area': {'hotel_count_weight': 0.6, 'country_hotel_count_weight': 0.4}
+    }
+    return {
+        query: (app.query_destinations(query), app.query_destinations(query, custom_weights))
+        for query in queries
+    }
+
+@pytest.mark.parametrize('change', [insert_rows, delete_rows, raise_global_max])
+def test_refresh_matches_full_build(workdir, change):
+    benchmark.generate_data('data', countries=10, cities=200, areas=1000)
+    app.init_database('data')
+    change('data')
+    stats = app.refresh_data('data')
+    assert stats['full_rescore'] == (change is raise_global_max)
+    
+    names = [row[1] for file_name in ('city.csv', 'area.csv') for row in read_rows(os.path.join('data', file_name))[1]]
+    queries = sorted({name[:length] for name in names for length in (2, 3, 4)})
+    refreshed = search_all(queries)
+    
+    shutil.copytree('data', 'rebuilt/data')
+    os.chdir('rebuilt')
+    for getter in PROCESS_OBJECTS:
+        getter.clear()
+    app.init_database('data')
+    assert search_all(queries) == refreshed
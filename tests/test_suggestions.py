@@ -0,0 +1,39 @@
+import app
+
+# Function to check every compiled prefix of the snapshot against the search
+def assert_snapshot_matches_search():
+    with app.read_connection() as conn:
+        prefixes = app.suggestion_prefixes(conn)
+    snapshot = app.SuggestionSnapshot()
+    try:
+        assert len(snapshot) == len(prefixes)
+        for prefix in prefixes:
+            assert snapshot.lookup(prefix) == app.query_destinations(prefix), prefix
+        # Queries are looked up by their terms, and longer prefixes are not compiled
+        assert snapshot.lookup(' NEW ') == app.query_destinations('new')
+        assert snapshot.lookup('new york') is None
+    finally:
+        snapshot.close()
+
+def test_snapshot_lookup_matches_search(international_database, monkeypatch):
+    monkeypatch.setattr(app, 'FUZZY_SEARCH', False)
+    assert app.compile_suggestion_snapshot() > 0
+    assert app.suggestion_snapshot_is_current()
+    assert_snapshot_matches_search()
+
+def test_snapshot_follows_weight_updates(international_database, monkeypatch):
+    monkeypatch.setattr(app, 'FUZZY_SEARCH', False)
+    app.compile_suggestion_snapshot()
+    app.update_weights('city', 0.05, 0.9)
+    # Without recompiling, the snapshot is stale for the new weights
+    assert not app.suggestion_snapshot_is_current()
+    snapshot = app.SuggestionSnapshot()
+    try:
+        assert snapshot.lookup('n') != app.query_destinations('n')
+    finally:
+        snapshot.close()
+    
+    monkeypatch.setattr(app, 'SUGGESTION_SNAPSHOT', True)
+    app.update_weights('area', 0.9, 0.05)
+    assert app.suggestion_snapshot_is_current()
+    assert_snapshot_matches_search()
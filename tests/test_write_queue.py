@@ -0,0 +1,47 @@
+import threading
+
+import app
+import benchmark
+
+# Function to occupy the writer thread of a queue until the returned event is set
+def block_writer(queue):
+    started = threading.Event()
+    release = threading.Event()
+    def hold():
+        started.set()
+        release.wait()
+    queue.submit(('block',), hold)
+    started.wait()
+    return release
+
+def test_pending_mutations_coalesce_in_submission_order():
+    queue = app.WriteQueue()
+    applied = []
+    release = block_writer(queue)
+    first = queue.submit(('update_weights', 'city'), applied.append, ('city', 1))
+    area = queue.submit(('update_weights', 'area'), applied.append, ('area', 1))
+    second = queue.submit(('update_weights', 'city'), applied.append, ('city', 2))
+    third = queue.submit(('update_weights', 'city'), applied.append, ('city', 3))
+    release.set()
+    
+    assert first is second is third
+    third.result(timeout=10)
+    area.result(timeout=10)
+    # The city update keeps its place ahead of the area update and applies the last arguments
+    assert applied == [('city', 3), ('area', 1)]
+    stats = queue.stats()
+    assert stats['submitted'] == 5
+    assert stats['coalesced'] == 2
+    assert stats['completed'] == 3
+
+def test_last_submitted_weights_win(workdir):
+    benchmark.generate_data('data', countries=10, cities=200, areas=1000)
+    app.init_database('data')
+    release = block_writer(app.get_write_queue())
+    futures = [app.submit_weights('city', weight, 0.5) for weight in (0.1, 0.2, 0.3)]
+    release.set()
+    
+    assert all(future.result(timeout=60) is True for future in futures)
+    assert app.get_write_queue().stats()['coalesced'] == 2
+    assert app.get_weights()['city'] == {'hotel_count_weight': 0.3, 'country_hotel_count_weight': 0.5}
+    assert app.get_ranked_weights()['city'] == app.get_weights()['city']